@@ -1,10 +1,15 @@
+import re
+
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from dataclasses import dataclass
-from typing import List, Set, Union
+from typing import Iterable, Iterator, List, Set, Tuple, Union
 from unicodedata import normalize
 
 from lark import Transformer, Lark
+from lark.exceptions import UnexpectedInput, LarkError
 
+from caches import LRUCache
 from enums import AdditionalArticulation, Place, Height, Backness
 from enums import Length, Phonation, Voice, Manner
 from enums import s, n
@@ -954,35 +959,220 @@ replacement_dict = {
 }
 
 
+def _can_overlap(x, y):
+    "Checks if x and y can share characters when put into one string."
+    if x in y or y in x:
+        return True
+    return any(x.endswith(y[:i]) or y.endswith(x[:i])
+               for i in range(1, min(len(x), len(y))))
+
+
+def _can_start_inside(earlier, later):
+    "Checks if an occurrence of later can begin inside an occurrence of earlier."
+    if earlier in later[1:]:
+        return True
+    return any(later.endswith(earlier[:i])
+               for i in range(1, min(len(earlier), len(later))))
+
+
+def _get_replacement_stages(replacements):
+    """
+    Splits the replacements into consecutive stages that can each be
+    applied in one left-to-right pass with the same result as applying
+    them one by one with str.replace. A replacement starts a new stage
+    if the string produced by an earlier replacement of the current
+    stage can be a part of its key, e.g. g -> ɡ in ŋgmb -> ŋɡmb, or
+    if its key can be found overlapping an earlier key from the left,
+    as a left-to-right pass would replace it first.
+    """
+    def get_replace_function(stage_replacements):
+        return lambda match: stage_replacements[match.group()]
+
+    stages = [[]]
+    for k, v in replacements.items():
+        if any(_can_overlap(k, earlier_v) or _can_start_inside(earlier_k, k)
+               for earlier_k, earlier_v in stages[-1]):
+            stages.append([])
+        stages[-1].append((k, v))
+    return [
+        # Alternatives are tried in the order of replacement_dict, not
+        # longest first: e.g. "n̠d̠" comes before "n̠d̠ʒ" and shadows it.
+        (re.compile('|'.join(re.escape(k) for k, _ in stage)),
+         get_replace_function(dict(stage)))
+        for stage in stages
+    ]
+
+
+REPLACEMENT_STAGES = _get_replacement_stages(replacement_dict)
+ANY_REPLACEMENT_REGEX = re.compile(
+    '|'.join(re.escape(k) for k in replacement_dict))
+
+
 #
 # The exported class
 #
 
+# The LALR tables are pickled here on the first run
+# and reused as long as the grammar does not change.
+LALR_CACHE_PATH = 'ipa_parse_grammar.lark.cache'
+
+# Nasals that can be read both as a separate consonant and
+# as pre-nasalisation of the following one, e.g. /mb/.
+AMBIGUOUS_NASALS = set('nmŋɳɲɱɴ')
+
+
+class SegmentParseError(Exception):
+    """
+    Reported by parse_many for segments that could not be parsed.
+    Lark exceptions cannot be sent back from worker processes,
+    so only their messages are kept.
+    """
+    pass
+
+
+def copy_error(error: LarkError) -> LarkError:
+    """
+    Returns a new instance of the error with the same attributes and
+    without a traceback or context. Lark errors cannot be rebuilt from
+    their args, so the instance is created without calling __init__.
+    """
+    error_type = type(error)
+    fresh = error_type.__new__(error_type)
+    fresh.__dict__.update(vars(error))
+    fresh.args = error.args
+    return fresh
+
+
 class IPAParser:
+    """
+    Segments are parsed by a deterministic LALR parser with a contextual
+    lexer, which is much faster than Earley. The grammar is not LALR as a
+    whole: "j" and "w" can start both a vowel and a consonant, so vowels
+    and consonants are parsed from separate start symbols, and a leading
+    nasal glyph cannot be told apart from pre-nasalisation by the lexer,
+    so the pre-nasalised reading, which is what Earley prefers, is tried
+    first by replacing the nasal with ⁿ. Anything the LALR parser
+    rejects is handed over to the Earley parser, which gives the same
+    result or raises the same errors as before.
+
+    Parses are memoised by the preprocessed string, so different spellings
+    of the same segment share an entry. Failures are memoised as well,
+    as the same invalid glyphs tend to be submitted again and again.
+    """
+
+    PARSE_CACHE_SIZE = 8192
+
     def __init__(self):
+        self.parse_cache = LRUCache(maxsize=self.PARSE_CACHE_SIZE)
         with open('ipa_parse_grammar.lark', 'r', encoding='utf-8') as inp:
-            self.parser = Lark(inp.read(), start='segment')
+            self.grammar = inp.read()
+        self.lalr_parser = Lark(self.grammar,
+                                start=['vowel', 'consonant'],
+                                parser='lalr',
+                                lexer='contextual',
+                                cache=LALR_CACHE_PATH)
+        # Built on first use.
+        self._earley_parser = None
         self.transformer = IPAQueryTransformer()
 
+    @property
+    def parser(self):
+        "The Earley parser for the full grammar."
+        if self._earley_parser is None:
+            self._earley_parser = Lark(self.grammar, start='segment')
+        return self._earley_parser
+
     def _preprocess(self, input_str):
         result = normalize('NFD', input_str.strip())
         # Replace single glyphs for uniformity.
         result = result.replace('\u02d4', '\u031d')   # Raised
         result = result.replace('\u0325', '\u030a')   # Voiceless
         # Replace glyph combinations
-        for k, v in replacement_dict.items():
-            result = result.replace(k, v)
+        if ANY_REPLACEMENT_REGEX.search(result) is None:
+            # Most segments need no replacements, and
+            # then nothing can be produced by cascading.
+            return result
+        for regex, replace in REPLACEMENT_STAGES:
+            if regex.search(result) is not None:
+                result = regex.sub(replace, result)
         return result
 
+    def _parse_lalr(self, preprocessed_str):
+        "Returns the Lark tree or None if the LALR parser cannot handle the input."
+        candidates = []
+        if preprocessed_str[:1] in AMBIGUOUS_NASALS:
+            candidates.append(('consonant', 'ⁿ' + preprocessed_str[1:]))
+        candidates.append(('vowel', preprocessed_str))
+        candidates.append(('consonant', preprocessed_str))
+        for start, text in candidates:
+            try:
+                return self.lalr_parser.parse(text, start=start)
+            except UnexpectedInput:
+                continue
+        return None
+
+    def _parse_tree(self, preprocessed_str):
+        tree = self._parse_lalr(preprocessed_str)
+        if tree is None:
+            tree = self.parser.parse(preprocessed_str)
+        return tree
+
     def parse(self, input_str):
-        "Returns the parse of input_str as a ConsonantParse or VowelParse."
-        return self.transformer.transform(
-            self.parser.parse(
-                self._preprocess(input_str)))
+        """
+        Returns the parse of input_str as a ConsonantParse or VowelParse.
+        Parses are shared between callers, so they must not be modified.
+        """
+        preprocessed_str = self._preprocess(input_str)
+        result = self.parse_cache.get(preprocessed_str)
+        if result is None:
+            try:
+                result = self.transformer.transform(
+                    self._parse_tree(preprocessed_str))
+            except LarkError as error:
+                # The cached error must not keep the frames of this parse alive.
+                result = copy_error(error)
+            self.parse_cache.put(preprocessed_str, result)
+        if isinstance(result, LarkError):
+            raise copy_error(result)
+        return result
+
+    def _parse_or_error(self, input_str):
+        try:
+            return self.parse(input_str)
+        except LarkError as error:
+            return SegmentParseError(str(error))
+
+    def parse_many(self, segments: Iterable[str], workers: int = 1,
+                   chunksize: int = 256) -> Iterator[Tuple[str, Union[ConsonantParse, VowelParse, SegmentParseError]]]:
+        """
+        Parses distinct segments from the iterable and yields pairs of
+        segments and their parses or SegmentParseErrors, in the order of
+        first occurrence. With more than one worker, chunks of segments
+        are parsed in a pool of processes, each with its own parser;
+        the parses are added to the memo of this parser.
+        """
+        segments = list(dict.fromkeys(segments))
+        if workers <= 1:
+            for segment in segments:
+                yield segment, self._parse_or_error(segment)
+            return
+        chunks = [segments[i:i+chunksize]
+                  for i in range(0, len(segments), chunksize)]
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_initialise_worker) as executor:
+            for chunk, results in zip(chunks, executor.map(_parse_chunk, chunks)):
+                for segment, result in zip(chunk, results):
+                    if not isinstance(result, SegmentParseError):
+                        self.parse_cache.put(self._preprocess(segment), result)
+                    yield segment, result
+
+    def cache_stats(self) -> dict:
+        "Returns the hit and miss counts and the size of the parse cache."
+        return self.parse_cache.stats()
 
     def parse_no_transform(self, input_str):
         "Returns the raw Lark output."
-        return self.parser.parse(
+        return self._parse_tree(
             self._preprocess(input_str))
 
 
@@ -991,6 +1181,22 @@ class IPAParser:
 # a more comprehensive test suite.
 #
 
+#
+# Worker processes for IPAParser.parse_many
+#
+
+_worker_parser = None
+
+
+def _initialise_worker():
+    global _worker_parser
+    _worker_parser = IPAParser()
+
+
+def _parse_chunk(segments: List[str]):
+    return [_worker_parser._parse_or_error(segment) for segment in segments]
+
+
 if __name__ == "__main__":
     import sys
     from pprint import pprint
@@ -1010,3 +1216,4 @@ if __name__ == "__main__":
     print()
     print('Parse as a (space-joined) list:')
     pprint(' '.join(result.as_list()))
+
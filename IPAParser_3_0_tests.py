@@ -1,5 +1,9 @@
 import unittest
-from IPAParser_3_0 import IPAParser
+from unicodedata import normalize
+
+from lark.exceptions import LarkError
+
+from IPAParser_3_0 import IPAParser, SegmentParseError, replacement_dict
 
 
 parser = IPAParser()
@@ -557,5 +561,86 @@ class TestVowelParsing(unittest.TestCase):
             })
     
 
+
+def preprocess_sequentially(input_str):
+    "The reference: replacements applied one by one in the order of replacement_dict."
+    result = normalize('NFD', input_str.strip())
+    result = result.replace('\u02d4', '\u031d')
+    result = result.replace('\u0325', '\u030a')
+    for k, v in replacement_dict.items():
+        result = result.replace(k, v)
+    return result
+
+
+class TestPreprocessing(unittest.TestCase):
+    """
+    The replacements are applied in a few regex passes. The cases
+    below depend on the order of replacement_dict, which the split
+    into passes must preserve.
+    """
+
+    def assertPreprocessed(self, input_str, expected):
+        self.assertEqual(preprocess_sequentially(input_str), expected)
+        self.assertEqual(parser._preprocess(input_str), expected)
+
+    def test_cascades(self):
+        # g -> ɡ feeds ŋɡmb -> ŋɡb.
+        self.assertPreprocessed('ŋgmb', 'ŋɡb')
+        self.assertPreprocessed('ŋ̤g̤', 'ŋɡ̤')
+        # n̠t̠ -> nt brings t and a second macron below together,
+        # which forms t̠ʃ -> tʃ.
+        self.assertPreprocessed('n̠t̠̠ʃ', 'ntʃ')
+        self.assertPreprocessed('n̠t̠ʃ', 'ntʃ')
+
+    def test_shadowing(self):
+        # n̠d̠ comes first and leaves nothing for n̠d̠ʒ.
+        self.assertPreprocessed('n̠d̠ʒ', 'ndʒ')
+        self.assertPreprocessed('n̠d̠', 'nd')
+
+    def test_overlapping_length_marks(self):
+        # The double-length pairs are replaced left to right
+        # in the order of the dictionary, not by the longest match.
+        self.assertPreprocessed('aː::', 'aː=')
+        self.assertPreprocessed('a::ː', 'a=ː')
+        self.assertPreprocessed('aːːː', 'a=ː')
+        self.assertPreprocessed('aːː:', 'a=:')
+        self.assertPreprocessed('aːːːː', 'a==')
+
+    def test_no_replacements(self):
+        self.assertPreprocessed('pʰ', 'pʰ')
+        self.assertPreprocessed('ɚː', 'ə\u02deː')
+
+
+class TestParseErrors(unittest.TestCase):
+
+    def test_cached_errors_are_raised_afresh(self):
+        errors = []
+        for _ in range(3):
+            with self.assertRaises(LarkError) as context:
+                parser.parse('qqq')
+            errors.append(context.exception)
+        self.assertEqual(len(set(map(id, errors))), 3)
+        self.assertEqual(len(set(map(str, errors))), 1)
+        self.assertEqual(len(set(map(type, errors))), 1)
+
+
+class TestParseMany(unittest.TestCase):
+
+    def test_worker_pool(self):
+        segments = ['p', 'qqq', 'aː', 'ŋgmb', 'p', 'tʃʰ', 'ʘ', 'ɪ̯ə', 'zzz', 'aː']
+        # Small chunks, so that the segments are spread over both workers.
+        results = list(IPAParser().parse_many(segments, workers=2, chunksize=2))
+        self.assertEqual([segment for segment, _ in results],
+                         list(dict.fromkeys(segments)))
+        for segment, result in results:
+            try:
+                expected = parser.parse(segment)
+            except LarkError as error:
+                self.assertIsInstance(result, SegmentParseError, segment)
+                self.assertEqual(str(result), str(error))
+            else:
+                self.assertEqual(result, expected)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
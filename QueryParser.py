@@ -1,3 +1,5 @@
+from unicodedata import normalize
+
 from lark import Lark, Transformer
 
 
@@ -85,14 +87,7 @@ class ASTNode():
         self.node_type = node_type
 
     def __str__(self):
-        buffer = [self.node_type]
-        for k, v in self.__dict__.items():
-            if k != 'node_type':
-                if issubclass(type(v), ASTNode):
-                    buffer.append(f'  {k}: {str_rec(v)}')
-                else:
-                    buffer.append(f'  {k}: {v}')
-        return '\n'.join(buffer)
+        return str_rec(self, 0)
 
 
 def str_rec(obj, depth=1):
@@ -101,11 +96,50 @@ def str_rec(obj, depth=1):
         if k != 'node_type':
             if issubclass(type(v), ASTNode):
                 buffer.append(f'{"  "*(depth+1)}{k}: {str_rec(v, depth+1)}')
+            elif type(v) == list:
+                # Operands of n-ary nodes
+                buffer.append(f'{"  "*(depth+1)}{k}:')
+                for el in v:
+                    buffer.append(f'{"  "*(depth+2)}- {str_rec(el, depth+2)}')
             else:
                 buffer.append(f'{"  "*(depth+1)}{k}: {v}')
     return '\n'.join(buffer)
 
 
+def get_canonical_form(query):
+    """
+    Returns a hashable representation of the query, which is the same
+    for equivalent spellings of the query: feature sets are sorted,
+    phonemes are NFD-normalised, and chains of "and" and "or" are
+    flattened with their operands sorted.
+    """
+    if type(query) == EqPhoneme:
+        return ('EqPhoneme', query.op, query.number, normalize('NFD', query.phoneme))
+    elif type(query) == EqFeature:
+        return ('EqFeature', query.op, query.number, tuple(sorted(query.features)))
+    elif type(query) == EqFeatures:
+        return ('EqFeatures', query.op,
+                tuple(sorted(query.features_1)),
+                tuple(sorted(query.features_2)))
+    elif type(query) == NotNode:
+        return ('NotNode', get_canonical_form(query.query))
+    elif type(query) == ConstNode:
+        return ('ConstNode', query.value)
+    elif type(query) in {AndNode, OrNode}:
+        operands = set()
+        stack = list(query.operands)
+        while stack:
+            operand = stack.pop()
+            if type(operand) == type(query):
+                stack.extend(operand.operands)
+            else:
+                operands.add(get_canonical_form(operand))
+        return (query.node_type, tuple(sorted(operands, key=repr)))
+    else:
+        raise NotImplementedError(
+            f'The query type is not recognised: {type(query)}')
+
+
 class EqPhoneme(ASTNode):
     def __init__(self, op, number, phoneme):
         super().__init__('EqPhoneme')
@@ -130,18 +164,19 @@ class EqFeatures(ASTNode):
         self.op = op
 
 
+# "and" and "or" nodes are n-ary, so that the optimiser
+# can flatten chains of them; the parser produces binary ones.
+
 class OrNode(ASTNode):
-    def __init__(self, q1, q2):
+    def __init__(self, *operands):
         super().__init__('OrNode')
-        self.lhs = q1
-        self.rhs = q2
+        self.operands = list(operands)
 
 
 class AndNode(ASTNode):
-    def __init__(self, q1, q2):
+    def __init__(self, *operands):
         super().__init__('AndNode')
-        self.lhs = q1
-        self.rhs = q2
+        self.operands = list(operands)
 
 
 class NotNode(ASTNode):
@@ -150,8 +185,23 @@ class NotNode(ASTNode):
         self.query = q
 
 
+class ConstNode(ASTNode):
+    "Matches all languages or none; only produced by the optimiser."
+
+    def __init__(self, value):
+        super().__init__('ConstNode')
+        self.value = value
+
+
+# The grammar is LALR(1): chains of "and" and "or" are left-recursive,
+# so they are left-associated, as Earley resolved them. Unlike Earley,
+# the contextual lexer always reads "and", "or", and "not" as keywords,
+# so they cannot be feature names, e.g. in "+ plosive and", which is now
+# a syntax error. The parse tables are pickled to search_grammar.lark.cache
+# and reused while the grammar is unchanged.
 with open(f'search_grammar.lark', 'r', encoding='utf-8') as inp:
-    query_parser = Lark(inp.read(), start='query')
+    query_parser = Lark(inp.read(), start='query', parser='lalr',
+                        cache='search_grammar.lark.cache')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import unittest
+
+from lark.exceptions import LarkError
+
+from QueryParser import query_parser, QueryTransformer
+from QueryParser import OrNode, AndNode, NotNode, EqPhoneme
+
+
+def parse(query_string):
+    return QueryTransformer().transform(query_parser.parse(query_string))
+
+
+def get_shape(query):
+    "Nested tuples of node types with phonemes at the leaves."
+    if type(query) == EqPhoneme:
+        return query.phoneme
+    elif type(query) == NotNode:
+        return ('not', get_shape(query.query))
+    elif type(query) == AndNode:
+        return ('and', *map(get_shape, query.operands))
+    elif type(query) == OrNode:
+        return ('or', *map(get_shape, query.operands))
+    raise NotImplementedError(type(query))
+
+
+class TestQueryParser(unittest.TestCase):
+
+    def assertShape(self, query_string, expected):
+        self.assertEqual(get_shape(parse(query_string)), expected)
+
+    def test_chains_are_left_associated(self):
+        self.assertShape('+ /a/ and + /b/ and + /c/',
+                         ('and', ('and', 'a', 'b'), 'c'))
+        self.assertShape('+ /a/ or + /b/ or + /c/',
+                         ('or', ('or', 'a', 'b'), 'c'))
+
+    def test_and_binds_tighter_than_or(self):
+        self.assertShape('+ /a/ or + /b/ and + /c/ or + /d/',
+                         ('or', ('or', 'a', ('and', 'b', 'c')), 'd'))
+        self.assertShape('+ /a/ and + /b/ or + /c/ and + /d/',
+                         ('or', ('and', 'a', 'b'), ('and', 'c', 'd')))
+        self.assertShape('+ /a/ and (+ /b/ or + /c/) and + /d/',
+                         ('and', ('and', 'a', ('or', 'b', 'c')), 'd'))
+
+    def test_not_binds_tightest(self):
+        self.assertShape('not + /a/ and + /b/',
+                         ('and', ('not', 'a'), 'b'))
+        self.assertShape('not (+ /a/ or + /b/) or not not + /c/',
+                         ('or', ('not', ('or', 'a', 'b')), ('not', ('not', 'c'))))
+
+    def test_keywords_are_not_features(self):
+        with self.assertRaises(LarkError):
+            parse('+ plosive and')
+        with self.assertRaises(LarkError):
+            parse('> 2 nasal or')
+
+
+if __name__ == '__main__':
+    unittest.main()
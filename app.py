@@ -1,7 +1,7 @@
 import json
 import base64
 
-from flask import Flask, request, make_response, jsonify
+from flask import Flask, Response, request, make_response, jsonify
 from pprint import pprint
 
 import query_processor as qp
@@ -37,12 +37,27 @@ def populate_headers_html(resp):
     allow_origin(resp)
 
 
+def make_cached_page_response(page):
+    "Answers with 304 if the client already has the current version."
+    resp = make_response(page.body, 200)
+    populate_headers_html(resp)
+    resp.set_etag(page.etag)
+    resp.last_modified = page.last_modified
+    return resp.make_conditional(request)
+
+
 def populate_headers_csv(resp, filename):
     resp.headers['Content-Type'] = 'text/csv'
     resp.headers['Content-Disposition'] = f'attachment; filename="{filename}.tsv"'
     allow_origin(resp)
 
 
+def populate_headers_gzip(resp, filename):
+    resp.headers['Content-Type'] = 'application/gzip'
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}.tsv.gz"'
+    allow_origin(resp)
+
+
 app = Flask(__name__)
 
 
@@ -51,14 +66,23 @@ app = Flask(__name__)
 
 @app.route('/dump/<table>', methods=['GET'])
 def dumper(table):
+    # The dump is streamed from a snapshot on disk,
+    # optionally gzipped (/dump/<table>?gzip).
+    compressed = 'gzip' in request.args
     try:
-        resp = make_response(dump_table_to_csv(table), 200)
+        snapshot = open_dump_snapshot(table, compressed)
     except:
         resp = make_response(
             'Failed to dump the table. Is the name correct?', 500)
         populate_headers_plain(resp)
         return resp
-    populate_headers_csv(resp, table)
+    resp = Response(iter_file_chunks(snapshot), 200)
+    # The generator does not close the file if it is never started.
+    resp.call_on_close(snapshot.close)
+    if compressed:
+        populate_headers_gzip(resp, table)
+    else:
+        populate_headers_csv(resp, table)
     return resp
 
 
@@ -209,15 +233,23 @@ def language_handler(action):
             resp = make_response('No language ID provided', 400)
             populate_headers_plain(resp)
             return resp
-        lang_dict = get_language_dict(request.args['lang_id'])
-        resp = make_response(get_language_page(lang_dict), 200)
-        populate_headers_html(resp)
-        return resp
+        try:
+            page_key = get_language_page_key(request.args['lang_id'])
+        except ValueError:
+            resp = make_response('Language ID must be an integer', 400)
+            populate_headers_plain(resp)
+            return resp
+        page = get_cached_page(
+            page_key,
+            lambda: get_language_page(get_language_dict(page_key[1])))
+        return make_cached_page_response(page)
     elif action == 'add':
         POST_data = json.loads(request.data)
         # try:
         # pprint(POST_data)
-        add_language_data(POST_data)
+        new_lang_id = add_language_data(POST_data)
+        # Make the new language searchable without a restart
+        qp.add_language(new_lang_id)
         resp = make_response('Language added', 200)
         populate_headers_plain(resp)
         # except:
@@ -232,9 +264,8 @@ def language_handler(action):
 
 @app.route('/', methods=['GET'])
 def homepage_handler():
-    resp = make_response(get_homepage(), 200)
-    populate_headers_html(resp)
-    return resp
+    return make_cached_page_response(
+        get_cached_page(HOMEPAGE_KEY, get_homepage))
 
 
 @app.route('/downloads', methods=['GET'])
@@ -0,0 +1,54 @@
+# Compares the throughput of the Earley and LALR segment parsers
+# on the distinct segments found in the inventory files.
+
+import json
+import sys
+from time import perf_counter
+
+from lark.exceptions import LarkError
+
+from IPAParser_3_0 import IPAParser
+
+
+def get_segments():
+    segments = set()
+    for path in ['inventories.json', 'inventories_phoible.json']:
+        with open(path, 'r', encoding='utf-8') as inp:
+            for inventory in json.load(inp).values():
+                # Brackets are stripped before parsing, as in prepare_parse_cache.
+                segments.update(
+                    segment.replace('(', '').replace(')', '')
+                    for segment in inventory)
+    return sorted(segments)
+
+
+def time_parser(parse_function, segments):
+    n_errors = 0
+    start = perf_counter()
+    for segment in segments:
+        try:
+            parse_function(segment)
+        except LarkError:
+            n_errors += 1
+    return perf_counter() - start, n_errors
+
+
+if __name__ == '__main__':
+    segments = get_segments()
+    if len(sys.argv) > 1:
+        segments = segments[:int(sys.argv[1])]
+    parser = IPAParser()
+
+    # Both sides bypass the parse cache of IPAParser.parse.
+    def parse_earley(segment):
+        return parser.transformer.transform(
+            parser.parser.parse(parser._preprocess(segment)))
+
+    def parse_lalr(segment):
+        return parser.transformer.transform(
+            parser._parse_tree(parser._preprocess(segment)))
+
+    print(f'{len(segments)} segments')
+    for name, parse_function in [('Earley', parse_earley), ('LALR', parse_lalr)]:
+        elapsed, n_errors = time_parser(parse_function, segments)
+        print(f'{name}: {elapsed:.2f} s, {len(segments) / elapsed:.0f} segments/s, {n_errors} errors')
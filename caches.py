@@ -0,0 +1,137 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Hashable, Iterable, NamedTuple, Tuple
+
+
+class LRUCache:
+    """
+    A thread-safe bounded mapping that evicts the least
+    recently used entry when it grows over maxsize.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb', **kwargs):
+    """
+    Yields a file object for a new temporary file next to path, which
+    is moved into place once it is written. Readers, including those
+    that map path into memory, see either the old or the new file and
+    never a partial one, and concurrent writers do not share their
+    temporary files. kwargs are passed on to open.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        # mkstemp creates files readable only by their owner.
+        try:
+            permissions = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            permissions = 0o644
+        os.chmod(tmp_path, permissions)
+        with os.fdopen(fd, mode, **kwargs) as out:
+            yield out
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def get_files_version(paths: Iterable[str]) -> Tuple:
+    """
+    Returns a cheap fingerprint of a set of data files that changes
+    whenever any of them is rewritten. Used to invalidate caches
+    that depend on these files.
+    """
+    result = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            result.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            result.append(None)
+    return tuple(result)
+
+
+class RenderedPage(NamedTuple):
+    body: str
+    etag: str
+    # Truncated to whole seconds, as in HTTP dates,
+    # so that If-Modified-Since comparisons work.
+    last_modified: datetime
+
+
+class PageCache:
+    """
+    Rendered HTML pages with the validators needed for conditional
+    requests. Callers include the version of the data a page shows in
+    its key, so that a change of the data made by any process makes
+    the page stale; stale pages are evicted as least recently used.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._pages = LRUCache(maxsize=maxsize)
+
+    def get(self, key: Hashable, render: Callable[[], str],
+            last_modified: datetime) -> RenderedPage:
+        "last_modified is the time the data were last changed."
+        page = self._pages.get(key)
+        if page is None:
+            body = render()
+            page = RenderedPage(
+                body,
+                hashlib.sha1(body.encode('utf-8')).hexdigest(),
+                last_modified.replace(microsecond=0))
+            self._pages.put(key, page)
+        return page
+
+    def stats(self) -> dict:
+        return self._pages.stats()
@@ -1,15 +1,73 @@
 import sqlite3
 import csv
+import glob
+import gzip
+import os
+import threading
 
+from collections import defaultdict
+from datetime import datetime, timezone
 from io import StringIO
 from unicodedata import normalize
 
+from caches import LRUCache, PageCache, atomic_write, get_files_version
+
 DBPATH = 'data/europhon.sqlite'
 BASE_URL = 'https://eurphon.info'
 # BASE_URL = 'http://127.0.0.1:11000'
 ISO_URL = 'https://iso639-3.sil.org/code'
 GLOTTOLOG_URL = 'https://glottolog.org/resource/languoid/id'
 
+# Rendered HTML of the homepage and of the language pages
+page_cache = PageCache()
+HOMEPAGE_KEY = 'homepage'
+
+
+def get_language_page_key(lang_id):
+    return ('language', int(lang_id))
+
+
+def get_cached_page(key, render):
+    """Pages are cached per version of the database, so additions made
+    through any server process are shown by all of them, and all of
+    them report the same Last-Modified time for the same page."""
+    version = get_files_version([DBPATH])
+    mtime_ns, _ = version[0]
+    return page_cache.get(
+        (key, version), render,
+        datetime.fromtimestamp(mtime_ns / 1e9, timezone.utc))
+
+
+# Language dicts without their ids, keyed by integer ids;
+# languages are never edited, so only additions invalidate them.
+language_dict_cache = LRUCache(maxsize=1024)
+
+
+# Connections for reading are opened once per thread and reused
+# by all requests served by it. The database is small and only
+# changes through add_language_data, so it is mapped into memory
+# in full, and the page cache is large enough to hold all of it.
+# Prepared statements are kept by each connection.
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KB = 64 * 1024
+CACHED_STATEMENTS = 256
+
+_thread_local = threading.local()
+
+
+def get_connection():
+    "Returns the read-only connection of the current thread."
+    connection = getattr(_thread_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(
+            DBPATH, cached_statements=CACHED_STATEMENTS)
+        connection.execute('PRAGMA query_only = ON')
+        connection.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        # Negative values are in KiB rather than in pages.
+        connection.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        _thread_local.connection = connection
+    return connection
+
 
 # Helper routines
 
@@ -26,7 +84,7 @@ def name_to_str(lang_name, alternate_names):
 
 
 def get_url_for_iso(iso):
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         try:
             lang_id = cursor.execute(
@@ -47,25 +105,111 @@ def get_iso_link(iso_code):
         return f'<a href="{ISO_URL}/{iso_code}">{iso_code}</a>'
 
 
-def dump_table_to_csv(table_name):
-    with sqlite3.connect(DBPATH) as connection:
+def get_table_columns(table_name):
+    with get_connection() as connection:
         cursor = connection.cursor()
-        table_names = [
+        if cursor.execute(
+            '''
+            SELECT COUNT(*)
+            FROM `sqlite_master`
+            WHERE `type` = 'table' AND `name` = ?
+            ''',
+            (table_name,)
+        ).fetchone()[0] == 0:
+            raise ValueError(f'No such table: {table_name}')
+        return [
             el[1] for el in cursor.execute(
                 f'PRAGMA table_info(`{table_name}`)'
             ).fetchall()]
-        csv_stream = StringIO()
-        csv_writer = csv.writer(csv_stream, delimiter='\t')
-        csv_writer.writerow(table_names)
-        for record in cursor.execute(
-                f'SELECT * FROM `{table_name}`'):
-            csv_writer.writerow(record)
-    return csv_stream.getvalue()
+
+
+def iter_table_tsv(table_name, rows_per_chunk=1000):
+    """Yields the table as TSV in chunks of rows_per_chunk rows,
+    so that the whole dump is never held in memory."""
+    table_names = get_table_columns(table_name)
+    csv_stream = StringIO()
+    csv_writer = csv.writer(csv_stream, delimiter='\t')
+    csv_writer.writerow(table_names)
+    cursor = get_connection().cursor()
+    cursor.execute(f'SELECT * FROM `{table_name}`')
+    while True:
+        records = cursor.fetchmany(rows_per_chunk)
+        if not records:
+            break
+        csv_writer.writerows(records)
+        yield csv_stream.getvalue()
+        csv_stream.seek(0)
+        csv_stream.truncate()
+    if csv_stream.tell():
+        yield csv_stream.getvalue()
+
+
+def dump_table_to_csv(table_name):
+    return ''.join(iter_table_tsv(table_name))
+
+
+# Dumps are written to disk once per version of the database
+# and then streamed from there to all clients.
+DUMP_SNAPSHOT_DIR = 'dump_snapshots'
+DUMP_CHUNK_SIZE = 64 * 1024
+
+
+def open_dump_snapshot(table_name, compressed=False):
+    """
+    Returns a binary file with a TSV or gzipped TSV dump of the current
+    data. The file is opened before older snapshots are removed, so
+    it can be read to the end after a newer snapshot replaces it.
+    """
+    # Raises on unknown tables before anything is written.
+    get_table_columns(table_name)
+    extension = 'tsv.gz' if compressed else 'tsv'
+    while True:
+        mtime_ns, size = get_files_version([DBPATH])[0]
+        path = os.path.join(DUMP_SNAPSHOT_DIR,
+                            f'{table_name}.{mtime_ns}-{size}.{extension}')
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            pass
+        os.makedirs(DUMP_SNAPSHOT_DIR, exist_ok=True)
+        with atomic_write(path) as raw_out:
+            if compressed:
+                out = gzip.GzipFile(fileobj=raw_out, mode='wb')
+            else:
+                out = raw_out
+            for chunk in iter_table_tsv(table_name):
+                out.write(chunk.encode('utf-8'))
+            if compressed:
+                out.close()
+        try:
+            snapshot = open(path, 'rb')
+        except FileNotFoundError:
+            # Removed by a request that has seen a newer version of the data.
+            continue
+        # Snapshots of other versions are not needed any more;
+        # clients still reading them keep their open files.
+        for old_path in glob.glob(os.path.join(DUMP_SNAPSHOT_DIR, f'{table_name}.*.{extension}')):
+            if old_path != path:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+        return snapshot
+
+
+def iter_file_chunks(inp):
+    "Yields the contents of an open binary file in chunks and closes it."
+    with inp:
+        while True:
+            chunk = inp.read(DUMP_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
 
 
 def get_phyla_dict():
     phyla_dict = {}
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         for (phylum_id, name, glottocode, alternate_names) in cursor.execute(
             'SELECT * FROM `phyla`'
@@ -79,7 +223,7 @@ def get_phyla_dict():
 
 def get_phylogenetic_tree():
     phylo_tree = {}
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         for (phylum_id, phylum_name, phylum_alternate_names) in cursor.execute(
             'SELECT `id`, `name`, `alternate_names` FROM `phyla`'
@@ -106,7 +250,7 @@ def get_phylogenetic_tree():
 
 def get_genera_for_phylum(phylum_id):
     genus_arr = []
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         for (genus_id, name, glottocode, alternate_names) in cursor.execute(
             '''SELECT `id`, `name`, `glottocode`, `alternate_names`
@@ -135,7 +279,7 @@ def get_all_langs(with_dialects=False):
     stmt = f'''SELECT `id`, `name`, `alternate_names`, `latitude`, `longitude`
     FROM `languages`
     WHERE `dialect` = {numeric_bool}'''
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         for (lang_id, name, alternate_names, lat, lon) in cursor.execute(stmt):
             langs_arr.append({
@@ -153,7 +297,7 @@ def get_langs_for_genus(genus_id, with_dialects=False):
     stmt = f'''SELECT `id`, `name`, `alternate_names`
     FROM `languages`
     WHERE `dialect` = {int(with_dialects)} AND `genus_id` = ?'''
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         for (lang_id, name, alternate_names) in cursor.execute(
             stmt,
@@ -171,7 +315,7 @@ def get_langs_for_phylum(phylum_id, with_dialects=False):
     stmt = f'''SELECT `id`, `name`, `alternate_names`
     FROM `languages`
     WHERE `dialect` = {int(with_dialects)} AND `phylum_id` = ?'''
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         for (lang_id, name, alternate_names) in cursor.execute(
             stmt,
@@ -185,7 +329,7 @@ def get_langs_for_phylum(phylum_id, with_dialects=False):
 
 
 def get_field_by_id(table_name, field_name, entity_id):
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         return cursor.execute(
             f'''
@@ -199,7 +343,7 @@ def get_field_by_foreign_id(table_name,
                             field_name,
                             foreign_id_column,
                             foreign_id):
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         return cursor.execute(
             f'''
@@ -210,130 +354,118 @@ def get_field_by_foreign_id(table_name,
 
 
 def get_language_dict(lang_id):
-    lang_dict = {
-        'id': lang_id
-    }
-    with sqlite3.connect(DBPATH) as connection:
+    lang_dict = language_dict_cache.get(int(lang_id))
+    if lang_dict is None:
+        lang_dict = fetch_language_dict(lang_id)
+        language_dict_cache.put(int(lang_id), lang_dict)
+    # The id is returned as it was passed, and
+    # callers get their own copy of the dict.
+    return {'id': lang_id, **lang_dict}
+
+
+def fetch_language_dict(lang_id):
+    """Reads everything about the language with one joined query
+    for the scalar fields and one query for the segments and tones."""
+    with get_connection() as connection:
         cursor = connection.cursor()
         (
             name,
             alternate_names,
-            phylum_id,
-            genus_id,
+            phylum,
+            genus,
             lat,
             lon,
             iso_code,
             source,
-            contributor_id,
+            comments,
+            contributor_name,
+            contributor_email,
+            initial_clusters,
+            finals,
+            syllabic_templates,
             is_dialect,
             head_dialect,
-            comments
+            head_dialect_name
         ) = cursor.execute(
             '''
-            SELECT `name`,
-                   `alternate_names`,
-                   `phylum_id`,
-                   `genus_id`,
-                   `latitude`,
-                   `longitude`,
-                   `iso_code`,
-                   `source`,
-                   `contributor_id`,
-                   `dialect`,
-                   `head_dialect`,
-                   `comments`
+            SELECT `languages`.`name`,
+                   `languages`.`alternate_names`,
+                   `phyla`.`name`,
+                   `genera`.`name`,
+                   `languages`.`latitude`,
+                   `languages`.`longitude`,
+                   `languages`.`iso_code`,
+                   `languages`.`source`,
+                   `languages`.`comments`,
+                   `contributors`.`name`,
+                   `contributors`.`email`,
+                   IFNULL((SELECT `initial_cluster`
+                           FROM `initial_clusters`
+                           WHERE `language_id` = `languages`.`id`), ''),
+                   IFNULL((SELECT `final`
+                           FROM `finals`
+                           WHERE `language_id` = `languages`.`id`), ''),
+                   IFNULL((SELECT `template`
+                           FROM `syllabic_templates`
+                           WHERE `language_id` = `languages`.`id`), ''),
+                   `languages`.`dialect`,
+                   `languages`.`head_dialect`,
+                   `head_dialects`.`name`
             FROM `languages`
-            WHERE `id` = ?
+            LEFT JOIN `phyla`
+                ON `phyla`.`id` = `languages`.`phylum_id`
+            LEFT JOIN `genera`
+                ON `genera`.`id` = `languages`.`genus_id`
+            LEFT JOIN `contributors`
+                ON `contributors`.`id` = `languages`.`contributor_id`
+            LEFT JOIN `languages` AS `head_dialects`
+                ON `head_dialects`.`id` = `languages`.`head_dialect`
+            WHERE `languages`.`id` = ?
             ''',
             (lang_id,)
         ).fetchone()
-        phylum = get_field_by_id('phyla', 'name', phylum_id)
-        genus = get_field_by_id('genera', 'name', genus_id)
-        contributor_name, contributor_email = cursor.execute(
+        consonants, vowels, tones = [], [], []
+        for source_table, _, is_consonant, value in cursor.execute(
             '''
-            SELECT `name`, `email`
-            FROM `contributors`
-            WHERE `id` = ?
+            SELECT 0 AS `source_table`, `id`, `is_consonant`, `ipa`
+            FROM `segments`
+            WHERE `language_id` = ?
+            UNION ALL
+            SELECT 1, `id`, NULL, `tone`
+            FROM `tones`
+            WHERE `language_id` = ?
+            ORDER BY `source_table`, `id`
             ''',
-            (contributor_id,)
-        ).fetchone()
-        lang_dict.update({
-            'name': name,
-            'alternate_names': alternate_names,
-            'phylum': phylum,
-            'genus': genus,
-            'lat': lat,
-            'lon': lon,
-            'iso_code': iso_code,
-            'source': source,
-            'comments': comments,
-            'contributor_name': contributor_name,
-            'contributor_email': contributor_email
-        })
-        lang_dict['consonants'] = [
-            el[0] for el in cursor.execute(
-                '''
-                SELECT `ipa`
-                FROM `segments`
-                WHERE `language_id` = ? AND `is_consonant` = 1
-                ''',
-                (lang_id,))
-        ]
-        lang_dict['vowels'] = [
-            el[0] for el in cursor.execute(
-                '''
-                SELECT `ipa`
-                FROM `segments`
-                WHERE `language_id` = ? AND `is_consonant` = 0
-                ''',
-                (lang_id,))
-        ]
-        lang_dict['tones'] = [
-            el[0] for el in cursor.execute(
-                '''
-                SELECT `tone`
-                FROM `tones`
-                WHERE `language_id` = ?
-                ''',
-                (lang_id,))
-        ]
-        try:
-            lang_dict['initial_clusters'] = get_field_by_foreign_id(
-                'initial_clusters',
-                'initial_cluster',
-                'language_id',
-                lang_id)
-        except:
-            lang_dict['initial_clusters'] = ''
-        try:
-            lang_dict['finals'] = get_field_by_foreign_id(
-                'finals',
-                'final',
-                'language_id',
-                lang_id)
-        except:
-            lang_dict['finals'] = ''
-        try:
-            lang_dict['syllabic_templates'] = get_field_by_foreign_id(
-                'syllabic_templates',
-                'template',
-                'language_id',
-                lang_id)
-        except:
-            lang_dict['syllabic_templates'] = ''
-        if is_dialect:
-            head_dialect_name = get_field_by_id(
-                'languages',
-                'name',
-                head_dialect)
-        else:
-            head_dialect_name = ''
-        lang_dict.update({
-            'is_dialect': bool(is_dialect),
-            'head_dialect_id': head_dialect,
-            'head_dialect_name': head_dialect_name
-        })
-        return lang_dict
+            (lang_id, lang_id)
+        ).fetchall():
+            if source_table == 1:
+                tones.append(value)
+            elif is_consonant == 1:
+                consonants.append(value)
+            elif is_consonant == 0:
+                vowels.append(value)
+    return {
+        'name': name,
+        'alternate_names': alternate_names,
+        'phylum': phylum,
+        'genus': genus,
+        'lat': lat,
+        'lon': lon,
+        'iso_code': iso_code,
+        'source': source,
+        'comments': comments,
+        'contributor_name': contributor_name,
+        'contributor_email': contributor_email,
+        'consonants': consonants,
+        'vowels': vowels,
+        'tones': tones,
+        'initial_clusters': initial_clusters,
+        'finals': finals,
+        'syllabic_templates': syllabic_templates,
+        'is_dialect': bool(is_dialect),
+        'head_dialect_id': head_dialect,
+        'head_dialect_name': head_dialect_name if is_dialect else ''
+    }
 
 
 def get_lang_link(lang_id, name, alternate_names, is_a_dialect=False):
@@ -351,126 +483,126 @@ def get_lang_link(lang_id, name, alternate_names, is_a_dialect=False):
             f'<a{style_element} class="lang-link" href="{BASE_URL}/languages/html?lang_id={lang_id}">{name}</a>')
 
 
-def get_lang_link_w_dialects(lang_id, name, alternate_names):
-    # Check if language has dialects
-    with sqlite3.connect(DBPATH) as connection:
-        cursor = connection.cursor()
-        dialect_count = cursor.execute(
-            f'''
-            SELECT COUNT(`id`)
-            FROM `languages`
-            WHERE `head_dialect` = {lang_id}
-            AND `deprecated` = 0
-            '''
-        ).fetchone()[0]
-        if dialect_count == 0:
-            dialect_str = ''
-        else:
-            tmp = []
-            for dialect_id, dialect_name, dialect_alternate_names in cursor.execute(
-                f'''
-                        SELECT `id`, `name`, `alternate_names`
-                        FROM `languages`
-                        WHERE `head_dialect` = {lang_id}
-                        '''
-            ):
-                tmp.append(
-                    get_lang_link(dialect_id,
-                                  dialect_name,
-                                  dialect_alternate_names,
-                                  True))
-            dialect_str = f' [{", ".join(tmp)}]'
+def get_lang_link_w_dialects(lang_id, name, alternate_names, dialects):
+    """Dialects map ids of head languages to lists of tuples
+    of the form (id, name, alternate_names)."""
+    if lang_id in dialects:
+        tmp = [get_lang_link(*dialect, True) for dialect in dialects[lang_id]]
+        dialect_str = f' [{", ".join(tmp)}]'
+    else:
+        dialect_str = ''
     return get_lang_link(lang_id, name, alternate_names) + dialect_str
 
 
-def get_lang_links(lang_list):
+def get_lang_links(lang_list, dialects):
     '''Lang list contains tuple of the form
     (id, name, alternate_names).'''
-    return ', '.join(get_lang_link_w_dialects(*el) for el in lang_list)
+    return ', '.join(get_lang_link_w_dialects(*el, dialects) for el in lang_list)
+
+
+def get_dialects(cursor):
+    """Returns the dialects of languages having at least one dialect
+    that is not deprecated. All the dialects of such languages are
+    listed, including the deprecated ones."""
+    all_dialects = defaultdict(list)
+    heads_with_current_dialects = set()
+    for dialect_id, dialect_name, dialect_alternate_names, head_dialect, deprecated in cursor.execute(
+        '''
+        SELECT `id`, `name`, `alternate_names`, `head_dialect`, `deprecated`
+        FROM `languages`
+        WHERE `head_dialect` IS NOT NULL
+        ORDER BY `id`
+        '''
+    ):
+        all_dialects[head_dialect].append(
+            (dialect_id, dialect_name, dialect_alternate_names))
+        if deprecated == 0:
+            heads_with_current_dialects.add(head_dialect)
+    return {
+        head_dialect: all_dialects[head_dialect]
+        for head_dialect in heads_with_current_dialects
+    }
 
 
 # TODO: print alternate names for phyla and genera
 # TODO: add a version without dialects
 def get_language_tree(with_dialects=True):
+    # The whole tree is fetched with a handful of bulk queries
+    # and grouped in memory.
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        phyla_arr = cursor.execute(
+            '''
+            SELECT `id`, `name`, `alternate_names`
+            FROM `phyla`
+            ORDER BY `id`
+            '''
+        ).fetchall()
+        language_counts = dict(cursor.execute(
+            '''
+            SELECT `phylum_id`, COUNT(`name`)
+            FROM `languages`
+            GROUP BY `phylum_id`
+            '''
+        ).fetchall())
+        genera_by_phylum = defaultdict(list)
+        for phylum_id, g_name, genus_id in cursor.execute(
+            '''
+            SELECT `phylum_id`, `name`, `id`
+            FROM `genera`
+            '''
+        ):
+            genera_by_phylum[phylum_id].append((g_name, genus_id))
+        langs_by_genus = defaultdict(list)
+        for lang_id, name, alternate_names, phylum_id, genus_id in cursor.execute(
+            '''
+            SELECT `id`, `name`, `alternate_names`, `phylum_id`, `genus_id`
+            FROM `languages`
+            WHERE `dialect` = 0
+                AND `deprecated` = 0
+            ORDER BY `id`
+            '''
+        ):
+            langs_by_genus[phylum_id, genus_id].append(
+                (lang_id, name, alternate_names))
+        dialects = get_dialects(cursor)
+
     out_stream = StringIO()
     out_stream.write('<ul>\n')
-    with sqlite3.connect(DBPATH) as connection:
-        cursor = connection.cursor()
-        phyla_arr = [
-            el for el in cursor.execute(
-                '''
-                SELECT `id`, `name`, `alternate_names`
-                FROM `phyla`
-                '''
-            )]
-        phyla_arr.sort(key=lambda x: x[1])
-        for phylum_id, phylum_name, phylum_alternate_names in phyla_arr:
-            language_count = cursor.execute(
-                f'''
-                SELECT COUNT(`name`)
-                FROM `languages`
-                WHERE `phylum_id` = {phylum_id}
-                '''
-            ).fetchone()[0]
-            if language_count == 0:
-                continue
-            phylum_full_name = name_to_str(phylum_name, phylum_alternate_names)
-            out_stream.write(
-                f'<li>{normalize("NFC", phylum_full_name)}\n<ul>\n')
-            genera_arr = [
-                el for el in cursor.execute(
-                    f'''
-                    SELECT `name`, `id`
-                    FROM `genera`
-                    WHERE `phylum_id` = {phylum_id}
-                    '''
-                )
-            ]
-            genera_arr.sort()
-            # TODO: cleanup genera without languages
-            if len(genera_arr) == 1 and genera_arr[0][0] == 'Ungrouped':
-                # Don't use any genera labels
-                lang_arr = [
-                    el for el in cursor.execute(
-                        f'''
-                        SELECT `id`, `name`, `alternate_names`
-                        FROM `languages`
-                        WHERE `phylum_id` = {phylum_id} 
-                            AND `genus_id` = {genera_arr[0][1]}
-                            AND `dialect` = 0
-                            AND `deprecated` = 0
-                        ''')]
+    phyla_arr.sort(key=lambda x: x[1])
+    for phylum_id, phylum_name, phylum_alternate_names in phyla_arr:
+        if language_counts.get(phylum_id, 0) == 0:
+            continue
+        phylum_full_name = name_to_str(phylum_name, phylum_alternate_names)
+        out_stream.write(
+            f'<li>{normalize("NFC", phylum_full_name)}\n<ul>\n')
+        genera_arr = sorted(genera_by_phylum[phylum_id])
+        # TODO: cleanup genera without languages
+        if len(genera_arr) == 1 and genera_arr[0][0] == 'Ungrouped':
+            # Don't use any genera labels
+            lang_arr = langs_by_genus[phylum_id, genera_arr[0][1]]
+            if lang_arr:
+                lang_arr.sort(key=lambda x: x[1])
+                lang_string = get_lang_links(lang_arr, dialects)
+                out_stream.write(f'<li>{lang_string}</li>\n')
+        else:
+            for g_name, genus_id in genera_arr:
+                lang_arr = langs_by_genus[phylum_id, genus_id]
                 if lang_arr:
+                    out_stream.write(
+                        f'<li><span style="font-variant: small-caps;">{normalize("NFC", g_name)}</span>: ')
                     lang_arr.sort(key=lambda x: x[1])
-                    lang_string = get_lang_links(lang_arr)
-                    out_stream.write(f'<li>{lang_string}</li>\n')
-            else:
-                for g_name, genus_id in genera_arr:
-                    lang_arr = [
-                        el for el in cursor.execute(
-                            f'''
-                            SELECT `id`, `name`, `alternate_names`
-                            FROM `languages`
-                            WHERE `phylum_id` = {phylum_id} 
-                                AND `genus_id` = {genus_id}
-                                AND `dialect` = 0
-                                AND `deprecated` = 0
-                            ''')]
-                    if lang_arr:
-                        out_stream.write(
-                            f'<li><span style="font-variant: small-caps;">{normalize("NFC", g_name)}</span>: ')
-                        lang_arr.sort(key=lambda x: x[1])
-                        lang_string = get_lang_links(lang_arr)
-                        out_stream.write(f'{lang_string}')
-                        out_stream.write('</li>\n')
-            out_stream.write('</ul>\n')
-            out_stream.write('</li>\n')
+                    lang_string = get_lang_links(lang_arr, dialects)
+                    out_stream.write(f'{lang_string}')
+                    out_stream.write('</li>\n')
+        out_stream.write('</ul>\n')
+        out_stream.write('</li>\n')
     out_stream.write('</ul>\n')
     return out_stream.getvalue()
 
 
 def get_all_contributors():
-    with sqlite3.connect(DBPATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         contributors_dict = {}
         for contr_id, name, email in cursor.execute(
@@ -487,6 +619,9 @@ def get_all_contributors():
 
 
 def add_language_data(data):
+    "Returns the id of the new language."
+    # Pooled connections are read-only, so writes
+    # go through a separate connection.
     with sqlite3.connect(DBPATH) as connection:
         cursor = connection.cursor()
 
@@ -595,3 +730,5 @@ def add_language_data(data):
                 'INSERT INTO `syllabic_templates` (`language_id`, `template`) VALUES (?,?)',
                 (new_lang_id, data['syllabic_templates']))
         connection.commit()
+    language_dict_cache.pop(new_lang_id)
+    return new_lang_id
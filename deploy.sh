@@ -6,10 +6,12 @@ search_eurphon="search"
 search_phoible="phoible"
 
 rsync *.json $app_target
+rsync *.bin $app_target
 rsync *.py $app_target
 rsync comparisonquery $app_target
 rsync countquery $app_target
 rsync phonemequery $app_target
+rsync querydaemon $app_target
 
 rsync -r webapp/search/* "$static_target$search_eurphon"
 rsync -r webapp/search_phoible/* "$static_target$search_phoible"
@@ -0,0 +1,132 @@
+"""
+A binary counterpart of the parse cache JSON files: a segment x feature
+matrix with one bit-packed row per segment, which can be memory-mapped
+and shared through the page cache by the query engines of all
+server processes. All numbers
+are little-endian:
+
+    header          magic, number of segments, number of features,
+                    bytes per row, and the sizes of the segment and
+                    feature string tables in bytes
+    rows            uint8[n_segments, row_size]; feature k of segment j
+                    is bit k % 8 (least significant first) of
+                    rows[j, k // 8]
+    segment_offsets uint32[n_segments + 1]
+    feature_offsets uint32[n_features + 1]
+    segments        the UTF-8 encoded segments
+    features        the UTF-8 encoded feature names
+
+See inventory_store.py for the string tables. The query engine
+checks features against the rows in place. The same file is read
+by the Go query daemon, which converts the rows into its own
+feature masks at startup.
+"""
+
+import mmap
+import struct
+
+from typing import Dict, List
+
+import numpy as np
+
+from caches import atomic_write
+from inventory_store import encode_string_table, decode_string_table
+
+MAGIC = b'EURFEA01'
+HEADER = struct.Struct('<8sIIIII')
+
+
+def write_feature_store(parses: Dict[str, List[str]], path: str):
+    "Parses map segments to their features, as in the parse cache."
+    segments = list(parses)
+    feature_index = {}
+    for parse in parses.values():
+        for feature in parse:
+            feature_index.setdefault(feature, len(feature_index))
+    matrix = np.zeros((len(segments), len(feature_index)), dtype=bool)
+    for row, segment in enumerate(segments):
+        matrix[row, [feature_index[feature] for feature in parses[segment]]] = True
+    rows = np.packbits(matrix, axis=1, bitorder='little')
+    row_size = (len(feature_index) + 7) // 8
+    segment_offsets, segment_strings = encode_string_table(segments)
+    feature_offsets, feature_strings = encode_string_table(list(feature_index))
+
+    with atomic_write(path) as out:
+        out.write(HEADER.pack(MAGIC, len(segments), len(feature_index), row_size,
+                              len(segment_strings), len(feature_strings)))
+        out.write(rows.tobytes())
+        out.write(segment_offsets.tobytes())
+        out.write(feature_offsets.tobytes())
+        out.write(segment_strings)
+        out.write(feature_strings)
+
+
+class FeatureStore:
+    """
+    A read-only view of a feature matrix file. The rows are
+    backed by the mapped file; only the string tables are decoded.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as inp:
+            self._buffer = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, n_segments, n_features, row_size,
+         segment_strings_size, feature_strings_size) = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC:
+            raise ValueError(f'Not a feature store: {path}')
+
+        position = HEADER.size
+        self.rows = np.frombuffer(
+            self._buffer, dtype=np.uint8, count=n_segments * row_size,
+            offset=position).reshape(n_segments, row_size)
+        position += self.rows.nbytes
+        segment_offsets = np.frombuffer(
+            self._buffer, dtype='<u4', count=n_segments + 1, offset=position)
+        position += segment_offsets.nbytes
+        feature_offsets = np.frombuffer(
+            self._buffer, dtype='<u4', count=n_features + 1, offset=position)
+        position += feature_offsets.nbytes
+        self.segments = decode_string_table(
+            segment_offsets, self._buffer[position:position+segment_strings_size])
+        position += segment_strings_size
+        self.features = decode_string_table(
+            feature_offsets, self._buffer[position:position+feature_strings_size])
+        self.segment_index = {
+            segment: row for row, segment in enumerate(self.segments)
+        }
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __contains__(self, segment: str):
+        return segment in self.segment_index
+
+    def unpack(self) -> np.ndarray:
+        "Returns the matrix as a segment x feature bool array."
+        return np.unpackbits(self.rows, axis=1, count=len(self.features),
+                             bitorder='little').astype(bool)
+
+    def get_features(self, segment: str) -> List[str]:
+        row = np.unpackbits(self.rows[self.segment_index[segment]],
+                            count=len(self.features), bitorder='little')
+        return [self.features[k] for k in np.flatnonzero(row).tolist()]
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        "Returns the parses in the format of the JSON files."
+        matrix = self.unpack()
+        return {
+            segment: [self.features[k] for k in np.flatnonzero(matrix[row]).tolist()]
+            for row, segment in enumerate(self.segments)
+        }
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    # Converts existing parse caches.
+    if len(sys.argv) != 3:
+        print('Usage: python feature_store.py parses_cache.json parses_cache.bin')
+        sys.exit(1)
+    with open(sys.argv[1], 'r', encoding='utf-8') as inp:
+        write_feature_store(json.load(inp), sys.argv[2])
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from feature_store import MAGIC, HEADER, write_feature_store, FeatureStore
+
+
+# Ten features, so that the rows take two bytes.
+PARSES = {
+    'p': ['consonant', 'bilabial', 'plosive', 'voiceless'],
+    'aː': ['vowel', 'open', 'central', 'unrounded', 'long'],
+    # A segment without features keeps a row of zeros.
+    'ʘ': [],
+    'b̤': ['consonant', 'bilabial', 'plosive', 'breathy voiced']
+}
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'parses_cache.bin')
+        write_feature_store(PARSES, self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        store = FeatureStore(self.path)
+        self.assertEqual(store.to_dict(), PARSES)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.get_features('ʘ'), [])
+        self.assertEqual(set(store.get_features('b̤')), set(PARSES['b̤']))
+        self.assertIn('aː', store)
+        # Segments the parser failed on are left out of the parse cache.
+        self.assertNotIn('q', store)
+
+    def test_empty_store(self):
+        write_feature_store({}, self.path)
+        store = FeatureStore(self.path)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.to_dict(), {})
+
+    def test_layout(self):
+        # The query engine masks the rows in place and the Go daemon
+        # converts them into its own masks; see feature_store.py.
+        store = FeatureStore(self.path)
+        with open(self.path, 'rb') as inp:
+            data = inp.read()
+        magic, n_segments, n_features, row_size, _, _ = HEADER.unpack_from(data)
+        self.assertEqual(magic, MAGIC)
+        self.assertEqual((n_segments, n_features, row_size), (4, 10, 2))
+        # Features are numbered in the order of their first occurrence.
+        self.assertEqual(store.features[:4], PARSES['p'])
+        self.assertEqual(store.features[9], 'breathy voiced')
+        rows = np.frombuffer(data, np.uint8, n_segments * row_size, HEADER.size)
+        rows = rows.reshape(n_segments, row_size)
+        # Feature k is bit k % 8, least significant first, of byte k // 8.
+        self.assertEqual(rows[0].tolist(), [0b00001111, 0])
+        self.assertEqual(rows[1].tolist(), [0b11110000, 0b01])
+        self.assertEqual(rows[2].tolist(), [0, 0])
+        self.assertEqual(rows[3].tolist(), [0b00000111, 0b10])
+        self.assertTrue(np.array_equal(store.rows, rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
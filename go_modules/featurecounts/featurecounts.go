@@ -111,3 +111,72 @@ func GetCountForFeatures(
 	}
 	return
 }
+
+//
+// A bitset index over segment parses
+//
+
+// MaxFeatures is the width of a FeatureMask in bits.
+const MaxFeatures = 128
+
+// FeatureMask is a fixed-width set of features.
+type FeatureMask [2]uint64
+
+func (m *FeatureMask) set(bit int) {
+	m[bit/64] |= 1 << uint(bit%64)
+}
+
+// Matches checks that the mask has all the features from pos
+// and none of the features from neg.
+func (m FeatureMask) Matches(pos FeatureMask, neg FeatureMask) bool {
+	return m[0]&pos[0] == pos[0] && m[1]&pos[1] == pos[1] &&
+		m[0]&neg[0] == 0 && m[1]&neg[1] == 0
+}
+
+// FeatureIndex maps every feature to a bit and every
+// segment to the mask of its features.
+type FeatureIndex struct {
+	features map[string]int
+	segments map[string]FeatureMask
+}
+
+// SegmentMasks converts an inventory into a slice of masks.
+// Segments without a parse get an empty mask, as they match
+// no positive features in GetCountForFeatures either.
+func (idx *FeatureIndex) SegmentMasks(inventory []string) []FeatureMask {
+	result := make([]FeatureMask, len(inventory))
+	for i, segment := range inventory {
+		result[i] = idx.segments[segment]
+	}
+	return result
+}
+
+// BundleMasks converts a feature bundle into a pair of masks.
+// If a positive feature is absent from the index, no segment
+// can match the bundle, and satisfiable is false. Unknown negative
+// features can be safely ignored.
+func (idx *FeatureIndex) BundleMasks(posFeatures []string, negFeatures []string) (pos FeatureMask, neg FeatureMask, satisfiable bool) {
+	for _, f := range posFeatures {
+		bit, ok := idx.features[f]
+		if !ok {
+			return pos, neg, false
+		}
+		pos.set(bit)
+	}
+	for _, f := range negFeatures {
+		if bit, ok := idx.features[f]; ok {
+			neg.set(bit)
+		}
+	}
+	return pos, neg, true
+}
+
+// CountMatches is the bitset counterpart of GetCountForFeatures.
+func CountMatches(pos FeatureMask, neg FeatureMask, masks []FeatureMask) (result int) {
+	for _, m := range masks {
+		if m.Matches(pos, neg) {
+			result++
+		}
+	}
+	return
+}
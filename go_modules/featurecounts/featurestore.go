@@ -0,0 +1,117 @@
+package featurecounts
+
+// A reader for the binary feature matrices written by feature_store.py.
+// The file is memory-mapped, and the bit-packed rows are used in place;
+// see feature_store.py for the layout.
+
+import (
+	"bytes"
+	"encoding/binary"
+	"fmt"
+	"os"
+	"syscall"
+	"unsafe"
+)
+
+const featureStoreMagic = "EURFEA01"
+
+// The magic string followed by five uint32 counts.
+const featureStoreHeaderSize = 8 + 5*4
+
+// FeatureStore is a read-only view of a feature matrix file.
+type FeatureStore struct {
+	// Feature k of segment j is bit k%8 of Rows[j*RowSize+k/8].
+	Rows     []byte
+	RowSize  int
+	Segments []string
+	Features []string
+	data     []byte
+}
+
+func decodeStringTable(offsets []uint32, table []byte) []string {
+	result := make([]string, len(offsets)-1)
+	for i := range result {
+		result[i] = string(table[offsets[i]:offsets[i+1]])
+	}
+	return result
+}
+
+// OpenFeatureStore maps a feature matrix file into memory.
+func OpenFeatureStore(path string) (*FeatureStore, error) {
+	file, err := os.Open(path)
+	if err != nil {
+		return nil, err
+	}
+	defer file.Close()
+	info, err := file.Stat()
+	if err != nil {
+		return nil, err
+	}
+	if info.Size() < featureStoreHeaderSize {
+		return nil, fmt.Errorf("not a feature store: %s", path)
+	}
+	data, err := syscall.Mmap(int(file.Fd()), 0, int(info.Size()),
+		syscall.PROT_READ, syscall.MAP_SHARED)
+	if err != nil {
+		return nil, err
+	}
+	if !bytes.Equal(data[:8], []byte(featureStoreMagic)) {
+		syscall.Munmap(data)
+		return nil, fmt.Errorf("not a feature store: %s", path)
+	}
+
+	nSegments := int(binary.LittleEndian.Uint32(data[8:]))
+	nFeatures := int(binary.LittleEndian.Uint32(data[12:]))
+	rowSize := int(binary.LittleEndian.Uint32(data[16:]))
+	segmentStringsSize := int(binary.LittleEndian.Uint32(data[20:]))
+	featureStringsSize := int(binary.LittleEndian.Uint32(data[24:]))
+	expectedSize := featureStoreHeaderSize + nSegments*rowSize +
+		4*(nSegments+1) + 4*(nFeatures+1) + segmentStringsSize + featureStringsSize
+	if len(data) != expectedSize {
+		syscall.Munmap(data)
+		return nil, fmt.Errorf("feature store is truncated: %s", path)
+	}
+
+	position := featureStoreHeaderSize
+	store := &FeatureStore{RowSize: rowSize, data: data}
+	store.Rows = data[position : position+nSegments*rowSize]
+	position += nSegments * rowSize
+	// The offsets are reinterpreted in place, which assumes
+	// a little-endian machine, as in inventorystore.go.
+	segmentOffsets := unsafe.Slice((*uint32)(unsafe.Pointer(&data[position])), nSegments+1)
+	position += 4 * (nSegments + 1)
+	featureOffsets := unsafe.Slice((*uint32)(unsafe.Pointer(&data[position])), nFeatures+1)
+	position += 4 * (nFeatures + 1)
+	store.Segments = decodeStringTable(segmentOffsets, data[position:position+segmentStringsSize])
+	position += segmentStringsSize
+	store.Features = decodeStringTable(featureOffsets, data[position:position+featureStringsSize])
+	return store, nil
+}
+
+// Close unmaps the file; the rows cannot be used afterwards.
+func (store *FeatureStore) Close() error {
+	return syscall.Munmap(store.data)
+}
+
+// NewFeatureIndexFromStore builds the index directly from the bit-packed
+// rows, which use the same bit numbering as FeatureMask.
+func NewFeatureIndexFromStore(store *FeatureStore) (*FeatureIndex, error) {
+	if len(store.Features) > MaxFeatures {
+		return nil, fmt.Errorf("more than %d features in the feature store", MaxFeatures)
+	}
+	idx := &FeatureIndex{
+		features: make(map[string]int, len(store.Features)),
+		segments: make(map[string]FeatureMask, len(store.Segments)),
+	}
+	for bit, f := range store.Features {
+		idx.features[f] = bit
+	}
+	for j, segment := range store.Segments {
+		var mask FeatureMask
+		for i, b := range store.Rows[j*store.RowSize : (j+1)*store.RowSize] {
+			mask[i/8] |= uint64(b) << uint(8*(i%8))
+		}
+		idx.segments[segment] = mask
+	}
+	return idx, nil
+}
@@ -0,0 +1,101 @@
+package featurecounts
+
+// A reader for the binary inventory files written by inventory_store.py.
+// The file is memory-mapped, and the integer arrays are used in place;
+// see inventory_store.py for the layout.
+
+import (
+	"bytes"
+	"encoding/binary"
+	"fmt"
+	"os"
+	"syscall"
+	"unsafe"
+)
+
+const inventoryStoreMagic = "EURINV01"
+
+// The magic string followed by four uint32 counts.
+const inventoryStoreHeaderSize = 8 + 4*4
+
+// InventoryStore is a read-only view of an inventory file.
+type InventoryStore struct {
+	LanguageIDs []int64
+	// The inventory of the i-th language is
+	// Entries[Offsets[i]:Offsets[i+1]].
+	Offsets []uint32
+	Entries []uint32
+	// Segments are indexed by the values of Entries.
+	Segments []string
+	data     []byte
+}
+
+// OpenInventoryStore maps an inventory file into memory.
+func OpenInventoryStore(path string) (*InventoryStore, error) {
+	file, err := os.Open(path)
+	if err != nil {
+		return nil, err
+	}
+	defer file.Close()
+	info, err := file.Stat()
+	if err != nil {
+		return nil, err
+	}
+	if info.Size() < inventoryStoreHeaderSize {
+		return nil, fmt.Errorf("not an inventory store: %s", path)
+	}
+	data, err := syscall.Mmap(int(file.Fd()), 0, int(info.Size()),
+		syscall.PROT_READ, syscall.MAP_SHARED)
+	if err != nil {
+		return nil, err
+	}
+	if !bytes.Equal(data[:8], []byte(inventoryStoreMagic)) {
+		syscall.Munmap(data)
+		return nil, fmt.Errorf("not an inventory store: %s", path)
+	}
+
+	nLanguages := int(binary.LittleEndian.Uint32(data[8:]))
+	nSegments := int(binary.LittleEndian.Uint32(data[12:]))
+	nEntries := int(binary.LittleEndian.Uint32(data[16:]))
+	stringsSize := int(binary.LittleEndian.Uint32(data[20:]))
+	expectedSize := inventoryStoreHeaderSize + 8*nLanguages +
+		4*(nLanguages+1) + 4*nEntries + 4*(nSegments+1) + stringsSize
+	if len(data) != expectedSize {
+		syscall.Munmap(data)
+		return nil, fmt.Errorf("inventory store is truncated: %s", path)
+	}
+
+	// The arrays are reinterpreted in place, which assumes
+	// a little-endian machine, as are all the deployment targets.
+	position := inventoryStoreHeaderSize
+	store := &InventoryStore{data: data}
+	store.LanguageIDs = unsafe.Slice((*int64)(unsafe.Pointer(&data[position])), nLanguages)
+	position += 8 * nLanguages
+	store.Offsets = unsafe.Slice((*uint32)(unsafe.Pointer(&data[position])), nLanguages+1)
+	position += 4 * (nLanguages + 1)
+	store.Entries = unsafe.Slice((*uint32)(unsafe.Pointer(&data[position])), nEntries)
+	position += 4 * nEntries
+	stringOffsets := unsafe.Slice((*uint32)(unsafe.Pointer(&data[position])), nSegments+1)
+	position += 4 * (nSegments + 1)
+	stringTable := data[position:]
+	store.Segments = make([]string, nSegments)
+	for i := range store.Segments {
+		store.Segments[i] = string(stringTable[stringOffsets[i]:stringOffsets[i+1]])
+	}
+	return store, nil
+}
+
+// Inventory returns the segments of the i-th language.
+func (store *InventoryStore) Inventory(i int) []string {
+	entries := store.Entries[store.Offsets[i]:store.Offsets[i+1]]
+	inventory := make([]string, len(entries))
+	for j, segmentID := range entries {
+		inventory[j] = store.Segments[segmentID]
+	}
+	return inventory
+}
+
+// Close unmaps the file; the arrays cannot be used afterwards.
+func (store *InventoryStore) Close() error {
+	return syscall.Munmap(store.data)
+}
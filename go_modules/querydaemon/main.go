@@ -0,0 +1,297 @@
+package main
+
+// A long-lived counterpart of phonemequery, countquery, and comparisonquery.
+// The inventories and parses for both datasets are loaded once at startup,
+// and then the daemon answers a stream of requests on stdin. Each request
+// and each response is a JSON document prefixed with its length as
+// a big-endian uint32. A request carries a whole query tree, which is
+// evaluated in one go.
+
+import (
+	"bufio"
+	"encoding/binary"
+	"encoding/json"
+	"fmt"
+	"io"
+	"log"
+	"os"
+	"runtime"
+	"sync"
+
+	fc "macleginn/featurecounts"
+)
+
+// Request is a query against one of the datasets; its kind is "query".
+type Request struct {
+	Dataset string     `json:"dataset"`
+	Kind    string     `json:"kind"`
+	Query   *QueryNode `json:"query"`
+}
+
+// QueryNode is a node of a serialised query tree. Leaves are "phoneme",
+// "count", and "comparison" predicates; inner nodes are "and", "or",
+// and "not" with their operands, and "const" nodes match all languages
+// or none depending on their value.
+type QueryNode struct {
+	Kind      string       `json:"kind"`
+	Operands  []*QueryNode `json:"operands"`
+	Value     bool         `json:"value"`
+	Op        string       `json:"op"`
+	Number    int          `json:"number"`
+	Phoneme   string       `json:"phoneme"`
+	Features  []string     `json:"features"`
+	Features2 []string     `json:"features_2"`
+}
+
+// Response holds either the list of matching language IDs or an error.
+type Response struct {
+	Result []int  `json:"result"`
+	Error  string `json:"error,omitempty"`
+}
+
+// The languages of a dataset, sorted by ID as in the inventory store,
+// are split into shards for whole queries.
+type dataset struct {
+	index         *fc.FeatureIndex
+	languageIDs   []int
+	inventoryList [][]string
+	// Inventories as slices of feature masks for count queries.
+	masksList [][]fc.FeatureMask
+}
+
+func loadDataset(inventoriesPath string, parsesPath string) *dataset {
+	d := &dataset{}
+	features, err := fc.OpenFeatureStore(parsesPath)
+	if err != nil {
+		log.Fatal(err)
+	}
+	if d.index, err = fc.NewFeatureIndexFromStore(features); err != nil {
+		log.Fatal(err)
+	}
+	features.Close()
+	store, err := fc.OpenInventoryStore(inventoriesPath)
+	if err != nil {
+		log.Fatal(err)
+	}
+	for i, languageID := range store.LanguageIDs {
+		inventory := store.Inventory(i)
+		d.languageIDs = append(d.languageIDs, int(languageID))
+		d.inventoryList = append(d.inventoryList, inventory)
+		d.masksList = append(d.masksList, d.index.SegmentMasks(inventory))
+	}
+	store.Close()
+	return d
+}
+
+// Returns 1 if the phoneme is found in the inventory and 0 otherwise.
+func getCountForPhoneme(phoneme string, inventory []string) (result int) {
+	result = 0
+	for _, segment := range inventory {
+		if segment == phoneme {
+			result = 1
+			break // We do not expect to meet a phoneme twice in an inventory.
+		}
+	}
+	return
+}
+
+func splitFeatures(rawFeatures []string) ([]string, []string) {
+	posFeatures := make([]string, 0)
+	negFeatures := make([]string, 0)
+	fc.InitialiseFeatures(rawFeatures, &posFeatures, &negFeatures)
+	return posFeatures, negFeatures
+}
+
+func answer(req *Request, datasets map[string]*dataset) ([]int, error) {
+	d, ok := datasets[req.Dataset]
+	if !ok {
+		return nil, fmt.Errorf("dataset not recognised: %s", req.Dataset)
+	}
+	if req.Kind != "query" {
+		return nil, fmt.Errorf("request kind not recognised: %s", req.Kind)
+	}
+	if req.Query == nil {
+		return nil, fmt.Errorf("no query provided")
+	}
+	root, err := d.compile(req.Query)
+	if err != nil {
+		return nil, err
+	}
+	return d.evaluate(root), nil
+}
+
+// A query node with its feature bundles converted to masks,
+// which is done once per query and not once per language.
+type compiledNode struct {
+	kind         string
+	operands     []*compiledNode
+	value        bool
+	op           string
+	number       int
+	phoneme      string
+	pos1, neg1   fc.FeatureMask
+	pos2, neg2   fc.FeatureMask
+	satisfiable1 bool
+	satisfiable2 bool
+}
+
+func (d *dataset) compile(node *QueryNode) (*compiledNode, error) {
+	if node == nil {
+		return nil, fmt.Errorf("empty query node")
+	}
+	result := &compiledNode{kind: node.Kind}
+	switch node.Kind {
+	case "and", "or", "not":
+		if node.Kind == "not" && len(node.Operands) != 1 {
+			return nil, fmt.Errorf("a \"not\" node must have one operand")
+		}
+		for _, operand := range node.Operands {
+			compiled, err := d.compile(operand)
+			if err != nil {
+				return nil, err
+			}
+			result.operands = append(result.operands, compiled)
+		}
+	case "const":
+		result.value = node.Value
+	case "phoneme", "count", "comparison":
+		switch node.Op {
+		case "=", "<", "<=", ">", ">=":
+		default:
+			return nil, fmt.Errorf("comparison operator not recognised: %s", node.Op)
+		}
+		result.op = node.Op
+		result.number = node.Number
+		result.phoneme = node.Phoneme
+		result.pos1, result.neg1, result.satisfiable1 = d.index.BundleMasks(splitFeatures(node.Features))
+		result.pos2, result.neg2, result.satisfiable2 = d.index.BundleMasks(splitFeatures(node.Features2))
+	default:
+		return nil, fmt.Errorf("query kind not recognised: %s", node.Kind)
+	}
+	return result, nil
+}
+
+// Checks if the i-th language satisfies the query.
+func (d *dataset) matches(node *compiledNode, i int) bool {
+	countMatches := func(pos, neg fc.FeatureMask, satisfiable bool) int {
+		if !satisfiable {
+			return 0
+		}
+		return fc.CountMatches(pos, neg, d.masksList[i])
+	}
+	switch node.kind {
+	case "and":
+		for _, operand := range node.operands {
+			if !d.matches(operand, i) {
+				return false
+			}
+		}
+		return true
+	case "or":
+		for _, operand := range node.operands {
+			if d.matches(operand, i) {
+				return true
+			}
+		}
+		return false
+	case "not":
+		return !d.matches(node.operands[0], i)
+	case "const":
+		return node.value
+	case "phoneme":
+		return fc.CheckDiff(node.op, getCountForPhoneme(node.phoneme, d.inventoryList[i])-node.number)
+	case "count":
+		return fc.CheckDiff(node.op, countMatches(node.pos1, node.neg1, node.satisfiable1)-node.number)
+	default: // "comparison"
+		return fc.CheckDiff(node.op,
+			countMatches(node.pos1, node.neg1, node.satisfiable1)-
+				countMatches(node.pos2, node.neg2, node.satisfiable2))
+	}
+}
+
+// Evaluates the query for all languages, which are split
+// into contiguous shards checked by separate goroutines.
+func (d *dataset) evaluate(root *compiledNode) []int {
+	nShards := runtime.GOMAXPROCS(0)
+	shardSize := (len(d.languageIDs) + nShards - 1) / nShards
+	shardResults := make([][]int, nShards)
+	var wg sync.WaitGroup
+	for shard := 0; shard < nShards; shard++ {
+		start := shard * shardSize
+		end := start + shardSize
+		if end > len(d.languageIDs) {
+			end = len(d.languageIDs)
+		}
+		if start >= end {
+			break
+		}
+		wg.Add(1)
+		go func(shard, start, end int) {
+			defer wg.Done()
+			for i := start; i < end; i++ {
+				if d.matches(root, i) {
+					shardResults[shard] = append(shardResults[shard], d.languageIDs[i])
+				}
+			}
+		}(shard, start, end)
+	}
+	wg.Wait()
+	result := []int{}
+	for _, shardResult := range shardResults {
+		result = append(result, shardResult...)
+	}
+	return result
+}
+
+func readFrame(reader *bufio.Reader) ([]byte, error) {
+	var length uint32
+	if err := binary.Read(reader, binary.BigEndian, &length); err != nil {
+		return nil, err
+	}
+	payload := make([]byte, length)
+	_, err := io.ReadFull(reader, payload)
+	return payload, err
+}
+
+func writeFrame(writer *bufio.Writer, payload []byte) error {
+	if err := binary.Write(writer, binary.BigEndian, uint32(len(payload))); err != nil {
+		return err
+	}
+	if _, err := writer.Write(payload); err != nil {
+		return err
+	}
+	return writer.Flush()
+}
+
+func main() {
+	// Initialise data caches
+	datasets := map[string]*dataset{
+		"eurphon": loadDataset("inventories.bin", "parses_cache.bin"),
+		"phoible": loadDataset("inventories_phoible.bin", "parses_cache_phoible.bin"),
+	}
+
+	reader := bufio.NewReader(os.Stdin)
+	writer := bufio.NewWriter(os.Stdout)
+	for {
+		payload, err := readFrame(reader)
+		if err == io.EOF {
+			return
+		} else if err != nil {
+			log.Fatal(err)
+		}
+		response := Response{}
+		req := Request{}
+		if err = json.Unmarshal(payload, &req); err != nil {
+			response.Error = err.Error()
+		} else if response.Result, err = answer(&req, datasets); err != nil {
+			response.Error = err.Error()
+		}
+		output, err := json.Marshal(response)
+		if err != nil {
+			log.Fatal(err)
+		}
+		if err = writeFrame(writer, output); err != nil {
+			log.Fatal(err)
+		}
+	}
+}
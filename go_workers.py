@@ -0,0 +1,101 @@
+import json
+import struct
+
+from queue import Queue
+from subprocess import Popen, PIPE
+from typing import Set
+
+# Requests and responses are JSON documents prefixed
+# with their length as a big-endian uint32.
+FRAME_HEADER = struct.Struct('>I')
+
+
+class GoWorkerError(Exception):
+    pass
+
+
+class GoWorker:
+    """
+    A wrapper around a single long-lived ./querydaemon process.
+    The daemon loads the inventories and parses for both datasets
+    once and then answers requests until its stdin is closed.
+    """
+
+    def __init__(self, binary_path: str = './querydaemon', generation: int = 0):
+        self.process = Popen([binary_path], stdin=PIPE, stdout=PIPE)
+        # The pool generation the worker was started in
+        self.generation = generation
+
+    def _read_exactly(self, n: int) -> bytes:
+        buffer = self.process.stdout.read(n)
+        if len(buffer) != n:
+            raise EOFError('The query daemon closed its output stream')
+        return buffer
+
+    def request(self, payload: dict):
+        message = json.dumps(payload).encode()
+        self.process.stdin.write(FRAME_HEADER.pack(len(message)) + message)
+        self.process.stdin.flush()
+        (length,) = FRAME_HEADER.unpack(self._read_exactly(FRAME_HEADER.size))
+        response = json.loads(self._read_exactly(length))
+        if response.get('error'):
+            raise GoWorkerError(response['error'])
+        return response['result']
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class GoWorkerPool:
+    """
+    A fixed-size pool of query daemons shared between request threads.
+    A worker is checked out for the duration of one request, so each
+    daemon only ever sees one conversation at a time.
+    """
+
+    def __init__(self, size: int = 4, binary_path: str = './querydaemon'):
+        self.binary_path = binary_path
+        self.generation = 0
+        self.workers = Queue()
+        for _ in range(size):
+            self.workers.put(GoWorker(binary_path))
+
+    def restart(self):
+        """
+        Makes the daemons reload the data files. Workers are replaced
+        when they are next checked out, so that requests in progress
+        are not interrupted.
+        """
+        self.generation += 1
+
+    def request(self, payload: dict):
+        worker = self.workers.get()
+        if worker.generation != self.generation:
+            worker.close()
+            worker = GoWorker(self.binary_path, self.generation)
+        try:
+            return worker.request(payload)
+        except (OSError, EOFError, ValueError):
+            # The process died or the stream got out of sync;
+            # replace the worker so that the pool does not shrink.
+            worker.process.kill()
+            worker = GoWorker(self.binary_path, self.generation)
+            raise
+        finally:
+            self.workers.put(worker)
+
+    def close(self):
+        while not self.workers.empty():
+            self.workers.get().close()
+
+    def evaluate(self, dataset: str, serialised_query: dict) -> Set[int]:
+        """
+        The whole query is evaluated in the daemon with one round trip;
+        see query_processor.serialise_query for the format.
+        """
+        return set(self.request({
+            'dataset': dataset,
+            'kind': 'query',
+            'query': serialised_query
+        }))
@@ -0,0 +1,138 @@
+"""
+A compact binary counterpart of the inventory JSON files, which can be
+memory-mapped instead of decoded. All numbers are little-endian:
+
+    header          magic, number of languages, number of distinct
+                    segments, total number of inventory entries, and
+                    the size of the string table in bytes
+    language_ids    int64[n_languages], sorted
+    offsets         uint32[n_languages + 1]; the inventory of the i-th
+                    language is entries[offsets[i]:offsets[i+1]]
+    entries         uint32[n_entries], segment ids
+    string_offsets  uint32[n_segments + 1]; segment j is
+                    strings[string_offsets[j]:string_offsets[j+1]]
+    strings         the UTF-8 encoded segments
+
+The same file is read by the Go query daemon.
+"""
+
+import mmap
+import struct
+import sys
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from caches import atomic_write
+
+MAGIC = b'EURINV01'
+HEADER = struct.Struct('<8sIIII')
+
+
+def encode_string_table(strings: List[str]) -> Tuple[np.ndarray, bytes]:
+    "Returns the offsets array and the UTF-8 data of a string table."
+    encoded_strings = [string.encode('utf-8') for string in strings]
+    offsets = np.cumsum(
+        [0] + [len(string) for string in encoded_strings], dtype=np.uint32)
+    return offsets.astype('<u4'), b''.join(encoded_strings)
+
+
+def decode_string_table(offsets: np.ndarray, data) -> List[str]:
+    """
+    The strings are interned, so that the segments and features of
+    different stores and the parses built from them share one copy.
+    """
+    offsets = offsets.tolist()
+    return [sys.intern(data[start:end].decode('utf-8'))
+            for start, end in zip(offsets, offsets[1:])]
+
+
+def write_inventory_store(inventories: Dict[str, List[str]], path: str):
+    "Inventories map language ids (as strings or integers) to lists of segments."
+    language_ids = sorted(int(language_id) for language_id in inventories)
+    inventories = {int(k): v for k, v in inventories.items()}
+    segment_ids = {}
+    offsets = [0]
+    entries = []
+    for language_id in language_ids:
+        for segment in inventories[language_id]:
+            entries.append(segment_ids.setdefault(segment, len(segment_ids)))
+        offsets.append(len(entries))
+    string_offsets, strings = encode_string_table(list(segment_ids))
+
+    with atomic_write(path) as out:
+        out.write(HEADER.pack(MAGIC, len(language_ids), len(segment_ids),
+                              len(entries), len(strings)))
+        out.write(np.array(language_ids, dtype='<i8').tobytes())
+        out.write(np.array(offsets, dtype='<u4').tobytes())
+        out.write(np.array(entries, dtype='<u4').tobytes())
+        out.write(string_offsets.tobytes())
+        out.write(strings)
+
+
+class InventoryStore:
+    """
+    A read-only view of an inventory file. The arrays are backed by
+    the mapped file; only the string table is decoded.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as inp:
+            self._buffer = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_languages, n_segments, n_entries, strings_size = HEADER.unpack_from(
+            self._buffer)
+        if magic != MAGIC:
+            raise ValueError(f'Not an inventory store: {path}')
+
+        position = HEADER.size
+
+        def get_array(dtype, length):
+            nonlocal position
+            array = np.frombuffer(self._buffer, dtype=dtype,
+                                  count=length, offset=position)
+            position += array.nbytes
+            return array
+
+        self.language_ids = get_array('<i8', n_languages)
+        self.offsets = get_array('<u4', n_languages + 1)
+        self.entries = get_array('<u4', n_entries)
+        string_offsets = get_array('<u4', n_segments + 1)
+        self.segments = decode_string_table(
+            string_offsets, self._buffer[position:position+strings_size])
+        self.ordinals = {
+            language_id: ordinal
+            for ordinal, language_id in enumerate(self.language_ids.tolist())
+        }
+
+    def __len__(self):
+        return len(self.language_ids)
+
+    def __contains__(self, language_id: int):
+        return language_id in self.ordinals
+
+    def get_segment_ids(self, language_id: int) -> np.ndarray:
+        ordinal = self.ordinals[language_id]
+        return self.entries[self.offsets[ordinal]:self.offsets[ordinal+1]]
+
+    def get_inventory(self, language_id: int) -> List[str]:
+        return [self.segments[segment_id]
+                for segment_id in self.get_segment_ids(language_id).tolist()]
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        "Returns the inventories in the format of the JSON files."
+        return {
+            str(language_id): self.get_inventory(language_id)
+            for language_id in self.language_ids.tolist()
+        }
+
+
+if __name__ == "__main__":
+    import json
+
+    # Converts existing JSON inventory files.
+    if len(sys.argv) != 3:
+        print('Usage: python inventory_store.py inventories.json inventories.bin')
+        sys.exit(1)
+    with open(sys.argv[1], 'r', encoding='utf-8') as inp:
+        write_inventory_store(json.load(inp), sys.argv[2])
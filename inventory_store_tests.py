@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from inventory_store import MAGIC, HEADER, write_inventory_store, InventoryStore
+
+
+INVENTORIES = {
+    '12': ['p', 't', 'aː', 'ŋ͡m'],
+    '3': ['t', 'i', 'ʔ'],
+    # Languages without segments keep their slot.
+    '7': [],
+    '40': ['aː', 'p', 't͡ʃʰ']
+}
+
+
+class TestInventoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'inventories.bin')
+        write_inventory_store(INVENTORIES, self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        store = InventoryStore(self.path)
+        self.assertEqual(store.to_dict(), INVENTORIES)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.get_inventory(7), [])
+        self.assertEqual(store.get_inventory(40), ['aː', 'p', 't͡ʃʰ'])
+        self.assertIn(3, store)
+        self.assertNotIn(5, store)
+
+    def test_integer_ids(self):
+        write_inventory_store({int(k): v for k, v in INVENTORIES.items()}, self.path)
+        self.assertEqual(InventoryStore(self.path).to_dict(), INVENTORIES)
+
+    def test_empty_store(self):
+        write_inventory_store({}, self.path)
+        store = InventoryStore(self.path)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.to_dict(), {})
+
+    def test_layout(self):
+        # The Go daemon reads the same layout; see inventory_store.py.
+        with open(self.path, 'rb') as inp:
+            data = inp.read()
+        magic, n_languages, n_segments, n_entries, strings_size = \
+            HEADER.unpack_from(data)
+        self.assertEqual(magic, MAGIC)
+        self.assertEqual((n_languages, n_segments, n_entries), (4, 7, 10))
+        position = HEADER.size
+        language_ids = np.frombuffer(data, '<i8', n_languages, position)
+        self.assertEqual(language_ids.tolist(), [3, 7, 12, 40])
+        position += 8 * n_languages
+        offsets = np.frombuffer(data, '<u4', n_languages + 1, position)
+        self.assertEqual(offsets.tolist(), [0, 3, 3, 7, 10])
+        position += 4 * (n_languages + 1)
+        entries = np.frombuffer(data, '<u4', n_entries, position)
+        # Segments are numbered in the order of their first occurrence.
+        self.assertEqual(entries.tolist(), [0, 1, 2, 3, 0, 4, 5, 4, 3, 6])
+        position += 4 * n_entries
+        string_offsets = np.frombuffer(data, '<u4', n_segments + 1, position)
+        position += 4 * (n_segments + 1)
+        strings = data[position:]
+        self.assertEqual(len(strings), strings_size)
+        self.assertEqual(strings[string_offsets[2]:string_offsets[3]].decode('utf-8'), 'ʔ')
+
+
+if __name__ == '__main__':
+    unittest.main()
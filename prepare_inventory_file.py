@@ -5,6 +5,8 @@ from collections import defaultdict
 from unicodedata import normalize
 import pandas as pd
 from IPAParser_3_0 import IPAParser
+from caches import atomic_write
+from inventory_store import write_inventory_store
 
 parser = IPAParser()
 
@@ -22,8 +24,9 @@ def prepare_eurphon():
             inventories[language_id].append(
                 normalize('NFD', segment))
 
-    with open('inventories.json', 'w', encoding='utf-8') as out:
+    with atomic_write('inventories.json', 'w', encoding='utf-8') as out:
         json.dump(inventories, out, indent=2, ensure_ascii=False)
+    write_inventory_store(inventories, 'inventories.bin')
 
 
 def prepare_phoible():
@@ -57,8 +60,9 @@ def prepare_phoible():
             else:
                 segment = row.Phoneme
             inventories[int(inventory_id)].append(normalize('NFD', segment))
-    with open('inventories_phoible.json', 'w', encoding='utf-8') as out:
+    with atomic_write('inventories_phoible.json', 'w', encoding='utf-8') as out:
         json.dump(inventories, out, indent=2, ensure_ascii=False)
+    write_inventory_store(inventories, 'inventories_phoible.bin')
 
 
 def inventory_parseable(phoible_chunk, parse_memo, unparsable_memo):
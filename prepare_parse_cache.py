@@ -1,46 +1,135 @@
 # TODO: run this as a procedure when the query engines starts.
 
 import os
+import sys
 import json
+import hashlib
 import sqlite3
 import pandas as pd
-from IPAParser_3_0 import IPAParser
+import IPAParser_3_0
+from IPAParser_3_0 import IPAParser, SegmentParseError
+from caches import atomic_write
+from feature_store import write_feature_store
 
 parser = IPAParser()
 
+# Segments are parsed in a pool of processes.
+WORKERS = os.cpu_count() or 1
 
-def prepare_eurphon():
+# Parses change whenever the grammar or the code preprocessing segments,
+# choosing between the parsers, or turning parse trees into features
+# changes. The code is spread over the parser module and the types it
+# uses, so these files are hashed as a whole: listing the relevant
+# functions and constants would let edits to the ones left out keep
+# stale parses under an unchanged stamp.
+PARSE_FILES = [
+    'ipa_parse_grammar.lark',
+    'IPAParser_3_0.py',
+    'enums.py',
+    'segment_types.py'
+]
+
+# The caches are read as plain segment -> features mappings by the
+# query engines and the Go binaries, so the grammar hash they were
+# built with is stored next to them. The stamps are committed
+# together with the caches, so that --incremental works
+# on a fresh checkout.
+GRAMMAR_HASH_SUFFIX = '.grammar_hash'
+
+
+def get_grammar_hash():
+    sha = hashlib.sha256()
+    for path in PARSE_FILES:
+        with open(path, 'rb') as inp:
+            sha.update(inp.read())
+    return sha.hexdigest()
+
+
+def load_parses_cache(path):
+    """
+    Returns the cached parses if they were made with
+    the current grammar and an empty dictionary otherwise.
+    """
+    try:
+        with open(path + GRAMMAR_HASH_SUFFIX, 'r', encoding='utf-8') as inp:
+            if inp.read().strip() != get_grammar_hash():
+                return {}
+        with open(path, 'r', encoding='utf-8') as inp:
+            return json.load(inp)
+    except FileNotFoundError:
+        return {}
+
+
+def save_parses_cache(parses_cache, path):
+    "Writes the JSON cache, its grammar hash, and the binary feature matrix."
+    with atomic_write(path, 'w', encoding='utf-8') as out:
+        json.dump(parses_cache, out, indent=2, ensure_ascii=False)
+    write_feature_store(parses_cache, path.replace('.json', '.bin'))
+    with atomic_write(path + GRAMMAR_HASH_SUFFIX, 'w', encoding='utf-8') as out:
+        print(get_grammar_hash(), file=out)
+
+
+def parse_new_segments(segments, old_cache):
+    "Yields pairs of segments and their parses; only segments missing from old_cache are parsed."
+    new_segments = [segment for segment in segments if segment not in old_cache]
+    print(f'{len(new_segments)} new segments to parse')
+    for segment in segments:
+        if segment in old_cache:
+            yield segment, old_cache[segment]
+    for segment, result in parser.parse_many(new_segments, workers=WORKERS):
+        if isinstance(result, SegmentParseError):
+            yield segment, result
+        else:
+            yield segment, result.as_list()
+
+
+def prepare_eurphon(incremental=False):
+    """
+    In the incremental mode, the existing cache is reused,
+    and only segments missing from it are parsed.
+    """
+    path = 'parses_cache.json'
+    old_cache = load_parses_cache(path) if incremental else {}
     parses_cache = {}
     conn = sqlite3.connect(os.path.join('data', 'europhon.sqlite'))
     cursor = conn.cursor()
-    for (segment,) in cursor.execute('SELECT DISTINCT ipa FROM segments'):
-        segment = segment.replace('(', '').replace(')', '')
-        if segment not in parses_cache:
-            parses_cache[segment] = parser.parse(segment).as_list()
-    with open('parses_cache.json', 'w', encoding='utf-8') as out:
-        json.dump(parses_cache, out, indent=2, ensure_ascii=False)
+    segments = list(dict.fromkeys(
+        segment.replace('(', '').replace(')', '')
+        for (segment,) in cursor.execute('SELECT DISTINCT ipa FROM segments')))
+    for segment, result in parse_new_segments(segments, old_cache):
+        if isinstance(result, SegmentParseError):
+            raise result
+        parses_cache[segment] = result
+    save_parses_cache(parses_cache, path)
 
 
-def prepare_phoible():
+def prepare_phoible(incremental=False):
+    "See prepare_eurphon."
+    path = 'parses_cache_phoible.json'
+    old_cache = load_parses_cache(path) if incremental else {}
     parses_cache = {}
     d = pd.read_csv(os.path.join('data', 'phoible.csv'), low_memory=False)
     d = d.loc[d.SegmentClass != 'tone']
     segments_table = d[['Phoneme', 'click']].drop_duplicates()
+    segments = []
     for row in segments_table.itertuples():
         if '+' in row.click:
             parses_cache[row.Phoneme] = ['click', 'consonant']
         else:
-            segment = row.Phoneme.split('|')[0]
-            if segment not in parses_cache:
-                try:
-                    parses_cache[segment] = parser.parse(segment).as_list()
-                except:
-                    print(f'Failed to parse /{segment}/')
-                    continue
-    with open('parses_cache_phoible.json', 'w', encoding='utf-8') as out:
-        json.dump(parses_cache, out, indent=2, ensure_ascii=False)
+            segments.append(row.Phoneme.split('|')[0])
+    segments = [segment for segment in dict.fromkeys(segments)
+                if segment not in parses_cache]
+    for segment, result in parse_new_segments(segments, old_cache):
+        if isinstance(result, SegmentParseError):
+            print(f'Failed to parse /{segment}/')
+            continue
+        parses_cache[segment] = result
+    save_parses_cache(parses_cache, path)
 
 
 if __name__ == "__main__":
-    prepare_eurphon()
-    prepare_phoible()
+    # With --incremental, only new segments are parsed, unless
+    # the grammar has changed since the caches were built.
+    incremental = '--incremental' in sys.argv[1:]
+    prepare_eurphon(incremental)
+    prepare_phoible(incremental)
@@ -0,0 +1,193 @@
+from typing import Set, Iterable, Optional
+
+import numpy as np
+
+from caches import LRUCache
+from inventory_store import InventoryStore
+from feature_store import FeatureStore
+
+
+def check_diff(op: str, diff: np.ndarray) -> np.ndarray:
+    "Checks elementwise that the query condition holds for the inventories."
+    if op == '=':
+        return diff == 0
+    elif op == '<':
+        return diff < 0
+    elif op == '<=':
+        return diff <= 0
+    elif op == '>':
+        return diff > 0
+    elif op == '>=':
+        return diff >= 0
+    else:
+        raise NotImplementedError(f'Comparison operator not recognised: {op}')
+
+
+class QueryEngine:
+    """
+    A resident replacement for the one-shot Go binaries: inventories
+    and segment parses are read from disk once, so that each leaf
+    predicate is answered for all languages at once by vectorised
+    operations.
+
+    The inventories are kept in the compressed sparse row layout of the
+    inventory store: the segments of language i are
+    entries[offsets[i]:offsets[i+1]]. Features are checked against the
+    bit-packed rows of the feature store, which are used in place, so
+    all processes share one copy of them through the page cache.
+
+    Languages are identified inside the engine by dense ordinals (their
+    positions in the inventory store), and predicates return bitmaps over
+    these ordinals as NumPy bool arrays, so that and/or/not queries
+    reduce to elementwise &, |, and ~.
+    """
+
+    # Bitmaps take one byte per language, so a full
+    # cache for PHOIBLE holds about 4 MB.
+    PREDICATE_CACHE_SIZE = 2048
+
+    def __init__(self, inventories_path: str, parses_path: str, dataset: str,
+                 version=None):
+        # The name of the dataset for the Go backend
+        self.dataset = dataset
+        # The version of the data files the engine was built from;
+        # results computed by the engine are cached under it.
+        self.version = version
+        # Leaf results shared between different queries. The cache
+        # lives and dies with the engine, so it never outlives the data.
+        self.predicate_cache = LRUCache(maxsize=self.PREDICATE_CACHE_SIZE)
+
+        inventories = InventoryStore(inventories_path)
+        parses = FeatureStore(parses_path)
+
+        # The store keeps languages sorted by id. Its arrays are
+        # used in place, and its segment ids index the segments here.
+        self.language_ids = np.array(inventories.language_ids, dtype=np.int64)
+        self.ordinals = inventories.ordinals
+        self.offsets = inventories.offsets.astype(np.int64)
+        self.entries = inventories.entries
+        self.universe = np.ones(len(self.language_ids), dtype=bool)
+        self.universe.flags.writeable = False
+        self.segment_index = {
+            segment: column for column, segment in enumerate(inventories.segments)
+        }
+        self.feature_index = {
+            feature: column for column, feature in enumerate(parses.features)
+        }
+
+        # Shares of languages having each segment; used
+        # to estimate the selectivity of queries.
+        rows = np.repeat(np.arange(len(self.language_ids)), np.diff(self.offsets))
+        language_segment_pairs = np.unique(
+            rows * len(self.segment_index) + self.entries)
+        self.segment_frequencies = np.bincount(
+            language_segment_pairs % len(self.segment_index),
+            minlength=len(self.segment_index)) / len(self.language_ids)
+
+        # The rows of the feature store for the segments. Segments
+        # without a parse point at an extra empty row, so they behave
+        # as if they had no features, which is what the Go binaries did.
+        self.feature_rows = parses.rows
+        self.parse_rows = np.array(
+            [parses.segment_index.get(segment, len(parses))
+             for segment in inventories.segments], dtype=np.int64)
+
+    def to_ids(self, bitmap: np.ndarray) -> Set[int]:
+        "Converts a bitmap into a set of language ids."
+        return set(self.language_ids[bitmap].tolist())
+
+    def from_ids(self, language_ids: Iterable[int]) -> np.ndarray:
+        "Converts language ids into a bitmap; unknown ids are ignored."
+        bitmap = np.zeros(len(self.language_ids), dtype=bool)
+        bitmap[[self.ordinals[language_id] for language_id in language_ids
+                if language_id in self.ordinals]] = True
+        return bitmap
+
+    def get_phoneme_frequency(self, phoneme: str) -> float:
+        if phoneme not in self.segment_index:
+            return 0.0
+        return float(self.segment_frequencies[self.segment_index[phoneme]])
+
+    def _get_feature_mask(self, features: Iterable[str]) -> np.ndarray:
+        "Packs features in the same way as the rows of the feature store."
+        mask = np.zeros(self.feature_rows.shape[1], dtype=np.uint8)
+        for feature in features:
+            column = self.feature_index[feature]
+            mask[column // 8] |= 1 << (column % 8)
+        return mask
+
+    def _get_matching_segments(self, pos_features: Iterable[str], neg_features: Iterable[str]) -> np.ndarray:
+        "Returns a bitmap of segments with all pos_features and no neg_features."
+        pos_features = list(pos_features)
+        if any(feature not in self.feature_index for feature in pos_features):
+            return np.zeros(len(self.segment_index), dtype=bool)
+        pos_mask = self._get_feature_mask(pos_features)
+        # Unknown negative features exclude nothing.
+        neg_mask = self._get_feature_mask(
+            feature for feature in neg_features if feature in self.feature_index)
+        rows = self.feature_rows
+        match = ((rows & pos_mask) == pos_mask).all(axis=1) &\
+            ((rows & neg_mask) == 0).all(axis=1)
+        # The empty row matches bundles without positive features.
+        return np.append(match, not pos_mask.any())[self.parse_rows]
+
+    def _count_segments(self, match: np.ndarray, candidates: Optional[np.ndarray]) -> np.ndarray:
+        """
+        Returns the number of segments marked in match in the inventory
+        of each language, or of each candidate language.
+        """
+        if candidates is None:
+            values = match[self.entries]
+            bounds = self.offsets
+        else:
+            starts = self.offsets[:-1][candidates]
+            lengths = self.offsets[1:][candidates] - starts
+            bounds = np.concatenate(([0], np.cumsum(lengths)))
+            # The positions of the entries of the candidates
+            # in the entries of all languages
+            positions = np.repeat(starts - bounds[:-1], lengths) +\
+                np.arange(bounds[-1])
+            values = match[self.entries[positions]]
+        # Differences of cumulative sums, unlike np.add.reduceat,
+        # give zeros for empty inventories.
+        totals = np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+        return totals[bounds[1:]] - totals[bounds[:-1]]
+
+    def _scatter(self, values: np.ndarray, candidates: Optional[np.ndarray]) -> np.ndarray:
+        "Expands a bitmap over the candidates to a bitmap over all languages."
+        if candidates is None:
+            return values
+        result = np.zeros(len(self.language_ids), dtype=bool)
+        result[candidates] = values
+        return result
+
+    def _get_counts(self, candidates: Optional[np.ndarray],
+                    pos_features: Iterable[str], neg_features: Iterable[str]) -> np.ndarray:
+        return self._count_segments(
+            self._get_matching_segments(pos_features, neg_features), candidates)
+
+    # All predicates accept an optional bitmap of candidate languages;
+    # languages outside it are not examined and are never matched.
+
+    def eq_phoneme(self, op: str, number: int, phoneme: str,
+                   candidates: Optional[np.ndarray] = None) -> np.ndarray:
+        "phoneme must be NFD-normalised, as are the inventories."
+        match = np.zeros(len(self.segment_index), dtype=bool)
+        if phoneme in self.segment_index:
+            match[self.segment_index[phoneme]] = True
+        # We do not expect to meet a phoneme twice in an inventory.
+        counts = np.minimum(self._count_segments(match, candidates), 1)
+        return self._scatter(check_diff(op, counts - number), candidates)
+
+    def eq_feature(self, op: str, number: int, pos_features: Iterable[str], neg_features: Iterable[str],
+                   candidates: Optional[np.ndarray] = None) -> np.ndarray:
+        counts = self._get_counts(candidates, pos_features, neg_features)
+        return self._scatter(check_diff(op, counts - number), candidates)
+
+    def eq_features(self, op: str,
+                    pos_features_1: Iterable[str], neg_features_1: Iterable[str],
+                    pos_features_2: Iterable[str], neg_features_2: Iterable[str],
+                    candidates: Optional[np.ndarray] = None) -> np.ndarray:
+        counts_1 = self._get_counts(candidates, pos_features_1, neg_features_1)
+        counts_2 = self._get_counts(candidates, pos_features_2, neg_features_2)
+        return self._scatter(check_diff(op, counts_1 - counts_2), candidates)
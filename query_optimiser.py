@@ -0,0 +1,218 @@
+"""
+An algebraic optimisation pass that runs between QueryTransformer
+and apply_query. Negations are pushed down and absorbed into the
+leaves by flipping their comparison operators (this relies on every
+language having an inventory, so that all counts are defined); and/or
+chains are flattened and deduplicated; contradictory conjunctions are
+replaced with a constant; and conjuncts are ordered by estimated
+selectivity and cost.
+"""
+
+from math import inf, prod
+from typing import Callable, Optional
+
+from QueryParser import ASTNode, OrNode, AndNode, NotNode, ConstNode
+from QueryParser import EqFeature, EqPhoneme, EqFeatures, get_canonical_form
+
+# Comparison operators of negated leaves
+NEGATED_OPS = {
+    '>': '<=',
+    '>=': '<',
+    '<': '>=',
+    '<=': '>'
+}
+
+# Relative costs of evaluating leaves
+LEAF_COSTS = {
+    EqPhoneme: 1,
+    EqFeature: 2,
+    EqFeatures: 4
+}
+
+DEFAULT_SELECTIVITY = 0.5
+
+
+def optimise(query: ASTNode,
+             get_selectivity: Optional[Callable[[ASTNode], Optional[float]]] = None) -> ASTNode:
+    """
+    get_selectivity returns the estimated share of languages
+    satisfying a leaf or None if there is no estimate.
+    """
+    query = push_negations(query)
+    query = simplify(query)
+    return order_operands(query, get_selectivity)
+
+
+#
+# Negations
+#
+
+
+def negate_leaf(query: ASTNode) -> ASTNode:
+    if type(query) == EqFeatures:
+        if query.op == '=':
+            return OrNode(
+                EqFeatures('<', query.features_1, query.features_2),
+                EqFeatures('>', query.features_1, query.features_2))
+        return EqFeatures(NEGATED_OPS[query.op], query.features_1, query.features_2)
+    if type(query) == EqPhoneme:
+        def make_leaf(op, number):
+            return EqPhoneme(op, number, query.phoneme)
+    else:
+        def make_leaf(op, number):
+            return EqFeature(op, number, query.features)
+    if query.op == '=':
+        if query.number == 0:
+            return make_leaf('>', 0)
+        return OrNode(
+            make_leaf('<', query.number),
+            make_leaf('>', query.number))
+    return make_leaf(NEGATED_OPS[query.op], query.number)
+
+
+def push_negations(query: ASTNode, negated: bool = False) -> ASTNode:
+    if type(query) == NotNode:
+        return push_negations(query.query, not negated)
+    elif type(query) in {AndNode, OrNode}:
+        operands = [push_negations(operand, negated)
+                    for operand in query.operands]
+        if negated:
+            # De Morgan's laws
+            return (OrNode if type(query) == AndNode else AndNode)(*operands)
+        return type(query)(*operands)
+    elif type(query) == ConstNode:
+        return ConstNode(query.value != negated)
+    elif negated:
+        return negate_leaf(query)
+    else:
+        return query
+
+
+#
+# Flattening, deduplication, and contradictions
+#
+
+
+def get_count_range(query: ASTNode):
+    "Returns the range of counts satisfying a leaf as a closed interval."
+    if query.op == '=':
+        lo, hi = query.number, query.number
+    elif query.op == '>':
+        lo, hi = query.number + 1, inf
+    elif query.op == '>=':
+        lo, hi = query.number, inf
+    elif query.op == '<':
+        lo, hi = 0, query.number - 1
+    else:
+        lo, hi = 0, query.number
+    if type(query) == EqPhoneme:
+        # A phoneme is either present in an inventory or not.
+        hi = min(hi, 1)
+    return max(lo, 0), hi
+
+
+def get_counted_term(query: ASTNode):
+    if type(query) == EqPhoneme:
+        return get_canonical_form(EqPhoneme('=', 0, query.phoneme))
+    else:
+        return get_canonical_form(EqFeature('=', 0, query.features))
+
+
+def is_contradictory(operands) -> bool:
+    "Checks if a conjunction of operands cannot be satisfied."
+    ranges = {}
+    for operand in operands:
+        if type(operand) not in {EqPhoneme, EqFeature}:
+            continue
+        term = get_counted_term(operand)
+        lo, hi = get_count_range(operand)
+        if term in ranges:
+            lo = max(lo, ranges[term][0])
+            hi = min(hi, ranges[term][1])
+        if lo > hi:
+            return True
+        ranges[term] = lo, hi
+    return False
+
+
+def simplify(query: ASTNode) -> ASTNode:
+    if type(query) in {EqPhoneme, EqFeature}:
+        lo, hi = get_count_range(query)
+        if lo > hi:
+            return ConstNode(False)
+        return query
+    elif type(query) not in {AndNode, OrNode}:
+        return query
+
+    # For "and", True operands can be dropped, and a False operand
+    # falsifies the whole node; vice versa for "or".
+    neutral = type(query) == AndNode
+    operands = []
+    seen = set()
+    stack = list(reversed(query.operands))
+    while stack:
+        operand = simplify(stack.pop())
+        if type(operand) == type(query):
+            stack.extend(reversed(operand.operands))
+            continue
+        if type(operand) == ConstNode:
+            if operand.value == neutral:
+                continue
+            return ConstNode(not neutral)
+        key = get_canonical_form(operand)
+        if key not in seen:
+            seen.add(key)
+            operands.append(operand)
+
+    if not operands:
+        return ConstNode(neutral)
+    elif len(operands) == 1:
+        return operands[0]
+    elif type(query) == AndNode and is_contradictory(operands):
+        return ConstNode(False)
+    return type(query)(*operands)
+
+
+#
+# Evaluation order
+#
+
+
+def estimate(query: ASTNode, get_selectivity):
+    "Returns the estimated selectivity and the cost of evaluating the query."
+    if type(query) == ConstNode:
+        return float(query.value), 0
+    elif type(query) == AndNode:
+        estimates = [estimate(operand, get_selectivity)
+                     for operand in query.operands]
+        return prod(s for s, _ in estimates), sum(c for _, c in estimates)
+    elif type(query) == OrNode:
+        estimates = [estimate(operand, get_selectivity)
+                     for operand in query.operands]
+        return 1 - prod(1 - s for s, _ in estimates), sum(c for _, c in estimates)
+    elif type(query) == NotNode:
+        selectivity, cost = estimate(query.query, get_selectivity)
+        return 1 - selectivity, cost
+    selectivity = get_selectivity(query) if get_selectivity is not None else None
+    if selectivity is None:
+        selectivity = DEFAULT_SELECTIVITY
+    return selectivity, LEAF_COSTS[type(query)]
+
+
+def order_operands(query: ASTNode, get_selectivity) -> ASTNode:
+    if type(query) == NotNode:
+        return NotNode(order_operands(query.query, get_selectivity))
+    elif type(query) not in {AndNode, OrNode}:
+        return query
+    operands = [order_operands(operand, get_selectivity)
+                for operand in query.operands]
+    if type(query) == AndNode:
+        # The conjunction can stop as soon as nothing is left,
+        # so the most selective operands go first.
+        operands.sort(key=lambda operand: estimate(operand, get_selectivity))
+    else:
+        # The disjunction can stop as soon as everything is covered.
+        operands.sort(key=lambda operand: (
+            -estimate(operand, get_selectivity)[0],
+            estimate(operand, get_selectivity)[1]))
+    return type(query)(*operands)
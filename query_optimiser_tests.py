@@ -0,0 +1,115 @@
+import unittest
+
+import query_processor as qp
+from QueryParser import OrNode, AndNode, ConstNode, EqPhoneme, EqFeature
+from QueryParser import get_canonical_form
+from query_optimiser import optimise, push_negations, simplify
+
+
+def parse(query_string):
+    return qp.parse_query(query_string)
+
+
+def rewrite(query_string):
+    "The optimiser without the reordering of operands."
+    return simplify(push_negations(parse(query_string)))
+
+
+class TestQueryOptimiser(unittest.TestCase):
+
+    def assertSameForm(self, query, query_string):
+        self.assertEqual(get_canonical_form(query),
+                         get_canonical_form(parse(query_string)))
+
+    def assertSameResults(self, query_string):
+        "The optimised query must select the same languages in both datasets."
+        query = parse(query_string)
+        for query_phoible in (False, True):
+            self.assertEqual(
+                qp.apply_query(optimise(query), query_phoible),
+                qp.apply_query(query, query_phoible),
+                query_string)
+
+    def test_double_negation(self):
+        self.assertSameForm(rewrite('not not + /p/'), '+ /p/')
+        self.assertSameForm(rewrite('not not > 2 plosive'), '> 2 plosive')
+        self.assertSameResults('not not + /p/')
+        self.assertSameResults('not (not > 2 plosive and + /t/)')
+
+    def test_de_morgan(self):
+        self.assertSameForm(
+            rewrite('not (+ /p/ and + /b/)'), '<= 0 /p/ or <= 0 /b/')
+        self.assertSameForm(
+            rewrite('not (> 2 plosive or < 1 nasal)'),
+            '<= 2 plosive and >= 1 nasal')
+        self.assertSameResults('not (+ /p/ and + /b/)')
+        self.assertSameResults('not (> 2 plosive or < 1 nasal)')
+        self.assertSameResults('not (> plosive, fricative or + /ʃ/)')
+
+    def test_negated_equality(self):
+        query = rewrite('not = 2 plosive')
+        self.assertEqual(type(query), OrNode)
+        self.assertSameForm(query, '< 2 plosive or > 2 plosive')
+        self.assertSameForm(rewrite('not = 0 nasal'), '> 0 nasal')
+        self.assertSameForm(
+            rewrite('not = plosive, fricative'),
+            '< plosive, fricative or > plosive, fricative')
+        self.assertSameResults('not = 2 plosive')
+        self.assertSameResults('not = 1 /p/')
+        self.assertSameResults('not = plosive, fricative')
+
+    def test_negated_phoneme_counts(self):
+        # A phoneme is counted at most once, so these are all
+        # equivalent to its absence or presence.
+        self.assertSameResults('not > 0 /p/')
+        self.assertSameResults('not < 1 /p/')
+        self.assertSameResults('not = 2 /p/')
+        self.assertSameResults('>= 2 /p/ or - /p/')
+
+    def test_contradictions(self):
+        query = rewrite('= 0 plosive and > 0 plosive')
+        self.assertEqual(type(query), ConstNode)
+        self.assertFalse(query.value)
+        query = rewrite('< 0 /p/')
+        self.assertEqual(type(query), ConstNode)
+        self.assertFalse(query.value)
+        query = rewrite('> 1 /p/')
+        self.assertEqual(type(query), ConstNode)
+        self.assertFalse(query.value)
+        # The contradiction falsifies the conjunction
+        # and then drops out of the disjunction.
+        self.assertSameForm(
+            rewrite('+ /t/ or (+ /p/ and - /p/)'), '+ /t/')
+        for query_string in (
+                '= 0 plosive and > 0 plosive',
+                '< 0 /p/',
+                '> 1 /p/',
+                'not < 0 /p/',
+                '+ /t/ or (+ /p/ and - /p/)',
+                '> 3 nasal and <= 2 nasal'):
+            self.assertSameResults(query_string)
+
+    def test_flattening_and_deduplication(self):
+        query = rewrite('+ /p/ and (+ /t/ and + /p/)')
+        self.assertEqual(type(query), AndNode)
+        self.assertEqual(len(query.operands), 2)
+        self.assertTrue(all(type(operand) == EqPhoneme
+                            for operand in query.operands))
+        query = rewrite('(> 2 plosive or + /p/) or (> 2 plosive or + /k/)')
+        self.assertEqual(type(query), OrNode)
+        self.assertEqual(len(query.operands), 3)
+        self.assertEqual(
+            sum(type(operand) == EqFeature for operand in query.operands), 1)
+        self.assertEqual(type(rewrite('+ /p/ and + /p/')), EqPhoneme)
+        self.assertSameResults('+ /p/ and (+ /t/ and + /p/)')
+        self.assertSameResults('(> 2 plosive or + /p/) or (> 2 plosive or + /k/)')
+
+    def test_reordering(self):
+        self.assertSameResults(
+            '> plosive, fricative and + /p/ and > 2 nasal and - /ʔ/')
+        self.assertSameResults(
+            '> plosive, fricative or + /p/ or > 2 nasal or - /ʔ/')
+
+
+if __name__ == '__main__':
+    unittest.main()
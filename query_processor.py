@@ -2,16 +2,25 @@ import sqlite3
 import json
 import io
 import os
+import sys
+import threading
 
-from subprocess import Popen, PIPE
 from collections import defaultdict
-from typing import Set
+from typing import Optional, Set
 from unicodedata import normalize
 from dataclasses import dataclass
 
-from QueryParser import query_parser, QueryTransformer, ASTNode, OrNode, AndNode, NotNode
-from QueryParser import EqFeature, EqPhoneme, EqFeatures
-from helpers import get_all_language_ids  # get_count_for_features, check_eq
+import numpy as np
+
+from QueryParser import query_parser, QueryTransformer, ASTNode, OrNode, AndNode, NotNode, ConstNode
+from QueryParser import EqFeature, EqPhoneme, EqFeatures, get_canonical_form
+from caches import LRUCache, atomic_write, get_files_version
+from query_engine import QueryEngine
+from inventory_store import InventoryStore, write_inventory_store
+from feature_store import write_feature_store
+from query_optimiser import optimise, get_count_range
+from go_workers import GoWorkerPool
+from IPAParser_3_0 import IPAParser, SegmentParseError
 
 #
 # Globals
@@ -95,8 +104,17 @@ python query_processor.py "< nasal consonant, lateral consonant" "genus=Avar-And
 '''
 
 
+# Metadata records are kept for every language, so they have no
+# instance dictionaries, and the names of phyla and genera, which
+# are repeated across languages, are interned.
+
+def intern_name(name):
+    return sys.intern(name) if isinstance(name, str) else name
+
+
 @dataclass
 class Language:
+    __slots__ = ('iso', 'name', 'phylum', 'genus', 'latitude', 'longitude')
     iso: str
     name: str
     phylum: str
@@ -105,13 +123,20 @@ class Language:
     longitude: str
 
 
-db_connection = sqlite3.connect(os.path.join('data', 'europhon.sqlite'))
-meta = {
-    language_id: Language(iso, language_name, phylum,
-                          genus, latitude, longitude)
-    for language_id, iso, language_name, phylum, genus, latitude, longitude
-    in db_connection.execute(
-        """
+@dataclass
+class PhoibleLanguage:
+    __slots__ = ('name', 'glottocode', 'phylum', 'genus', 'latitude', 'longitude')
+    name: str
+    glottocode: str
+    phylum: str
+    genus: str
+    latitude: float
+    longitude: float
+
+
+def get_language_meta(db_connection: sqlite3.Connection, language_id: Optional[int] = None):
+    "Returns the metadata for all languages or only for language_id."
+    query = """
             SELECT 
                 languages.id, languages.`iso_code`, languages.name, 
                 phyla.name, genera.name, languages.latitude, languages.longitude
@@ -120,55 +145,244 @@ meta = {
                     languages.phylum_id = phyla.id
                 LEFT JOIN genera ON
                     languages.genus_id = genera.id
-            """)
-}
+            """
+    params = ()
+    if language_id is not None:
+        query += "WHERE languages.id = ?"
+        params = (language_id,)
+    return {
+        language_id: Language(iso, language_name, intern_name(phylum),
+                              intern_name(genus), latitude, longitude)
+        for language_id, iso, language_name, phylum, genus, latitude, longitude
+        in db_connection.execute(query, params)
+    }
+
+
+DB_PATH = os.path.join('data', 'europhon.sqlite')
+db_connection = sqlite3.connect(DB_PATH)
+# Filled in by load_language_meta, which add_language and the rebuilds
+# of the EURPhon engine after additions in other processes call again.
+meta = {}
 
 with open(f'phoible_meta.json', 'r', encoding='utf-8') as inp:
-    meta_phoible = json.load(inp)
+    meta_phoible = {
+        int(language_id): PhoibleLanguage(
+            record['name'], record['glottocode'],
+            intern_name(record['phylum']), intern_name(record['genus']),
+            record['latitude'], record['longitude'])
+        for language_id, record in json.load(inp).items()
+    }
 
 query_transformer = QueryTransformer()
 
+query_result_cache = LRUCache(maxsize=256)
+
+# Raw query strings from the web UI to their ASTs
+parsed_query_cache = LRUCache(maxsize=1024)
+
+
+def apply_query(query: ASTNode, query_phoible: bool = False,
+                candidates: Optional[np.ndarray] = None,
+                engine: Optional[QueryEngine] = None) -> Set[int]:
+    """
+    Applies the query transformed into an ASTNode to the inventories
+    and returns a set of inventory ids. If candidates are provided,
+    only the languages from this bitmap are examined.
+
+    The engine defaults to the current one for the dataset. Engines are
+    swapped when languages are added, so callers that obtained candidates
+    from an engine must pass the same engine.
 
-def apply_query(query: ASTNode, db_connection: sqlite3.Connection, query_phoible: bool = False) -> Set[int]:
+    With the Go backend, the whole query is sent to a daemon in one
+    message instead of one round trip per leaf.
     """
-    Recursively applies the query transformed into an ASTNode to the inventories
-    stored in the database and returns a set of inventory ids.
+    if engine is None:
+        engine = get_engine(query_phoible)
+    if candidates is None:
+        candidates = engine.universe
+    if go_pool is not None:
+        result = go_pool.evaluate(engine.dataset, serialise_query(query))
+        return engine.to_ids(engine.from_ids(result) & candidates)
+    return engine.to_ids(evaluate_query(query, candidates, engine))
+
+
+def evaluate_query(query: ASTNode, candidates: np.ndarray, engine: QueryEngine) -> np.ndarray:
+    """
+    Recursively evaluates the query for the candidate languages and returns
+    a bitmap over the language ordinals of the corresponding engine.
+    Each subquery only examines languages that can still change the
+    result: the survivors of the preceding conjuncts for "and" and the
+    languages not yet matched by the preceding disjuncts for "or".
     """
     if type(query) == OrNode:
-        return apply_query(query.lhs, db_connection, query_phoible) | apply_query(query.rhs, db_connection, query_phoible)
+        result = np.zeros_like(candidates)
+        for operand in query.operands:
+            remaining = candidates & ~result
+            if not remaining.any():
+                break
+            result = result | evaluate_query(operand, remaining, engine)
+        return result
     elif type(query) == AndNode:
-        return apply_query(query.lhs, db_connection, query_phoible) & apply_query(query.rhs, db_connection, query_phoible)
+        result = candidates
+        for operand in query.operands:
+            if not result.any():
+                break
+            result = evaluate_query(operand, result, engine)
+        return result
     elif type(query) == NotNode:
-        return get_all_language_ids(db_connection, query_phoible) - apply_query(query.query, db_connection, query_phoible)
-    elif type(query) == EqPhoneme:
-        return apply_eq_phoneme_go(query, query_phoible)
-    elif type(query) == EqFeature:
-        return apply_eq_feature_go(query, query_phoible)
-    elif type(query) == EqFeatures:
-        return apply_eq_features_go(query, query_phoible)
+        return candidates & ~evaluate_query(query.query, candidates, engine)
+    elif type(query) == ConstNode:
+        return candidates if query.value else np.zeros_like(candidates)
+    elif type(query) in {EqPhoneme, EqFeature, EqFeatures}:
+        return apply_predicate(query, candidates, engine)
     else:
         raise NotImplementedError(
             f'The query type is not recognised: {type(query)}')
 
 
-# It turned out to be much faster to iterate over inventories,
-# both as IPA-encoded segments and as lists of lists of features,
-# in separate Go binaries than do this in Python itself, even
-# if they have to read all the data from disk first for each run!
-# The main motivation for keeping the Python wrapper is to continue
-# using Lark.
+def get_selectivity(query: ASTNode, query_phoible: bool = False):
+    "Estimates the share of languages satisfying a leaf for the optimiser."
+    if type(query) != EqPhoneme:
+        return None
+    lo, hi = get_count_range(query)
+    if lo == 0 and hi >= 1:
+        return 1.0
+    frequency = get_engine(query_phoible).get_phoneme_frequency(
+        normalize('NFD', query.phoneme))
+    return frequency if lo >= 1 else 1.0 - frequency
 
-def apply_eq_phoneme_go(query: EqPhoneme, query_phoible: bool = False):
-    test_segment = normalize('NFD', query.phoneme)
-    input_string = '\n'.join([
-        'phoible' if query_phoible else 'eurphon',
-        query.op,
-        str(query.number),
-        test_segment
-    ]) + '\n'
-    go_process = Popen(['./phonemequery'], stdin=PIPE, stdout=PIPE)
-    output = go_process.communicate(input=input_string.encode())[0].decode()
-    return set(json.loads(output))
+
+def optimise_query(query: ASTNode, query_phoible: bool = False) -> ASTNode:
+    return optimise(query, lambda leaf: get_selectivity(leaf, query_phoible))
+
+
+def get_predicate_key(query: ASTNode):
+    """
+    Feature bundles are normalised with supply_defaults,
+    so that equivalent bundles share a cache entry.
+    """
+    if type(query) == EqPhoneme:
+        return ('EqPhoneme', query.op, query.number, normalize('NFD', query.phoneme))
+    elif type(query) == EqFeature:
+        return ('EqFeature', query.op, query.number,
+                frozenset(supply_defaults(query.features)))
+    else:
+        return ('EqFeatures', query.op,
+                frozenset(supply_defaults(query.features_1)),
+                frozenset(supply_defaults(query.features_2)))
+
+
+# If the candidates make up at least this share of all languages,
+# the predicate is evaluated for all of them, and the result is
+# memoised; smaller candidate sets are evaluated on their own.
+FULL_EVALUATION_THRESHOLD = 0.5
+
+
+def apply_predicate(query: ASTNode, candidates: np.ndarray, engine: QueryEngine) -> np.ndarray:
+    "Evaluates a leaf of the query for the candidates, memoising full results."
+    predicate_cache = engine.predicate_cache
+    key = get_predicate_key(query)
+    result = predicate_cache.get(key)
+    if result is not None:
+        return result & candidates
+    if candidates.mean() >= FULL_EVALUATION_THRESHOLD:
+        result = apply_leaf(query, None, engine)
+        # The bitmap is shared between queries from now on.
+        result.flags.writeable = False
+        predicate_cache.put(key, result)
+        return result & candidates
+    return apply_leaf(query, candidates, engine)
+
+
+def apply_leaf(query: ASTNode, candidates: Optional[np.ndarray], engine: QueryEngine) -> np.ndarray:
+    if type(query) == EqPhoneme:
+        return apply_eq_phoneme(query, candidates, engine)
+    elif type(query) == EqFeature:
+        return apply_eq_feature(query, candidates, engine)
+    else:
+        return apply_eq_features(query, candidates, engine)
+
+
+# The leaf predicates used to be answered by separate Go binaries that
+# re-read all the data from disk on each run. Now there are two backends
+# that load inventories and parses once and keep them in memory for the
+# lifetime of the process: the in-process Python engines (the default)
+# and a pool of long-lived Go daemons (EURPHON_QUERY_BACKEND=go).
+# The Go daemons evaluate whole queries, so the leaf functions above
+# and the per-predicate cache are only used by the Python engines.
+# The engines are needed in both cases, since they map language ids
+# to the ordinals used in result bitmaps.
+
+ENGINE_FILES = {
+    False: ('inventories.bin', 'parses_cache.bin', 'eurphon'),
+    True: ('inventories_phoible.bin', 'parses_cache_phoible.bin', 'phoible')
+}
+
+
+def get_engine_version(query_phoible: bool):
+    """
+    Changes whenever the files the engine is built from are rewritten.
+    The database is not included: add_language_data commits a new language
+    before add_language rewrites the stores, and the engine only changes
+    once they have been rewritten.
+    """
+    inventories_path, parses_path, _ = ENGINE_FILES[query_phoible]
+    return get_files_version([inventories_path, parses_path])
+
+
+def load_language_meta():
+    "Adds the metadata of languages that are new in the database."
+    with sqlite3.connect(DB_PATH) as connection:
+        meta.update(get_language_meta(connection))
+
+
+def build_engine(query_phoible: bool) -> QueryEngine:
+    # The version is taken before the files are read, so that
+    # if they are rewritten meanwhile, the engine is rebuilt again.
+    version = get_engine_version(query_phoible)
+    return QueryEngine(*ENGINE_FILES[query_phoible], version)
+
+
+load_language_meta()
+
+
+engines = {
+    False: build_engine(False),
+    True: build_engine(True)
+}
+
+
+def get_engine(query_phoible: bool = False) -> QueryEngine:
+    """
+    Returns the engine for the dataset, which is first rebuilt if its files
+    have been rewritten, e.g. by add_language in another server process.
+    While a refresh is in progress, queries go on using the old engine.
+    """
+    engine = engines[query_phoible]
+    if engine.version != get_engine_version(query_phoible) \
+            and refresh_lock.acquire(blocking=False):
+        try:
+            engine = engines[query_phoible]
+            if engine.version != get_engine_version(query_phoible):
+                if not query_phoible:
+                    # The stores are rewritten after the database,
+                    # so the new languages are already there.
+                    load_language_meta()
+                engine = engines[query_phoible] = build_engine(query_phoible)
+                if go_pool is not None:
+                    go_pool.restart()
+        finally:
+            refresh_lock.release()
+    return engine
+
+QUERY_BACKEND = os.environ.get('EURPHON_QUERY_BACKEND', 'python')
+if QUERY_BACKEND == 'go':
+    go_pool = GoWorkerPool(
+        int(os.environ.get('EURPHON_GO_WORKERS', '4')))
+elif QUERY_BACKEND == 'python':
+    go_pool = None
+else:
+    raise ValueError(f'Query backend not recognised: {QUERY_BACKEND}')
 
 
 def supply_defaults(input_set):
@@ -180,35 +394,136 @@ def supply_defaults(input_set):
     return feature_set
 
 
-def apply_eq_feature_go(query: EqFeature, query_phoible: bool = False):
-    prefixed_features = [
-        f'{prefix}{feature}' for prefix, feature in supply_defaults(query.features)]
-    input_string = '\n'.join([
-        'phoible' if query_phoible else 'eurphon',
-        query.op,
-        str(query.number),
-        json.dumps(prefixed_features)
-    ]) + '\n'
-    print(input_string)
-    go_process = Popen(['./countquery'], stdin=PIPE, stdout=PIPE)
-    output = go_process.communicate(input=input_string.encode())[0].decode()
-    return set(json.loads(output))
-
-
-def apply_eq_features_go(query: EqFeatures, query_phoible: bool = False):
-    prefixed_features1 = [
-        f'{prefix}{feature}' for prefix, feature in supply_defaults(query.features_1)]
-    prefixed_features2 = [
-        f'{prefix}{feature}' for prefix, feature in supply_defaults(query.features_2)]
-    input_string = '\n'.join([
-        'phoible' if query_phoible else 'eurphon',
+def split_features(input_set):
+    "Returns positive and negative features with the defaults supplied."
+    feature_set = supply_defaults(input_set)
+    pos_features = set(feature for prefix, feature in feature_set if prefix == '+')
+    neg_features = set(feature for prefix, feature in feature_set if prefix == '-')
+    return pos_features, neg_features
+
+
+def prefix_features(input_set):
+    "Returns +A, -B features with the defaults supplied for the Go backend."
+    return [f'{prefix}{feature}' for prefix, feature in supply_defaults(input_set)]
+
+
+def apply_eq_phoneme(query: EqPhoneme, candidates: Optional[np.ndarray], engine: QueryEngine):
+    test_segment = normalize('NFD', query.phoneme)
+    return engine.eq_phoneme(
+        query.op, query.number, test_segment, candidates)
+
+
+def apply_eq_feature(query: EqFeature, candidates: Optional[np.ndarray], engine: QueryEngine):
+    pos_features, neg_features = split_features(query.features)
+    return engine.eq_feature(
+        query.op, query.number, pos_features, neg_features, candidates)
+
+
+def apply_eq_features(query: EqFeatures, candidates: Optional[np.ndarray], engine: QueryEngine):
+    pos_features_1, neg_features_1 = split_features(query.features_1)
+    pos_features_2, neg_features_2 = split_features(query.features_2)
+    return engine.eq_features(
         query.op,
-        json.dumps(prefixed_features1),
-        json.dumps(prefixed_features2)
-    ]) + '\n'
-    go_process = Popen(['./comparisonquery'], stdin=PIPE, stdout=PIPE)
-    output = go_process.communicate(input=input_string.encode())[0].decode()
-    return set(json.loads(output))
+        pos_features_1, neg_features_1,
+        pos_features_2, neg_features_2,
+        candidates)
+
+
+def serialise_query(query: ASTNode) -> dict:
+    """
+    Converts the query into nested dicts for the Go backend.
+    Leaves are "phoneme", "count", and "comparison" predicates.
+    """
+    if type(query) == OrNode:
+        return {'kind': 'or', 'operands': [serialise_query(operand) for operand in query.operands]}
+    elif type(query) == AndNode:
+        return {'kind': 'and', 'operands': [serialise_query(operand) for operand in query.operands]}
+    elif type(query) == NotNode:
+        return {'kind': 'not', 'operands': [serialise_query(query.query)]}
+    elif type(query) == ConstNode:
+        return {'kind': 'const', 'value': query.value}
+    elif type(query) == EqPhoneme:
+        return {
+            'kind': 'phoneme',
+            'op': query.op,
+            'number': query.number,
+            'phoneme': normalize('NFD', query.phoneme)
+        }
+    elif type(query) == EqFeature:
+        return {
+            'kind': 'count',
+            'op': query.op,
+            'number': query.number,
+            'features': prefix_features(query.features)
+        }
+    elif type(query) == EqFeatures:
+        return {
+            'kind': 'comparison',
+            'op': query.op,
+            'features': prefix_features(query.features_1),
+            'features_2': prefix_features(query.features_2)
+        }
+    else:
+        raise NotImplementedError(
+            f'The query type is not recognised: {type(query)}')
+
+
+#
+# Adding languages
+#
+
+# Refreshes are serialised with each other but do not block queries.
+refresh_lock = threading.Lock()
+segment_parser = IPAParser()
+
+
+def write_json_atomically(obj, path):
+    with atomic_write(path, 'w', encoding='utf-8') as out:
+        json.dump(obj, out, indent=2, ensure_ascii=False)
+
+
+def add_language(language_id: int):
+    """
+    Makes a language that has just been added to the database visible to
+    queries without a restart: its inventory is appended to the inventory
+    files, its unseen segments are parsed into parses_cache.json, and a new
+    EURPhon engine is built from these files and swapped in. Queries that
+    are already running finish with the old engine. Cached results are
+    keyed by the versions of the engines, so they are never mixed up.
+    """
+    with refresh_lock:
+        with sqlite3.connect(DB_PATH) as connection:
+            segments = [segment for (segment,) in connection.execute(
+                "SELECT ipa FROM segments WHERE `language_id` = ?",
+                (language_id,))]
+        inventories = InventoryStore('inventories.bin').to_dict()
+        with open('parses_cache.json', 'r', encoding='utf-8') as inp:
+            parses_cache = json.load(inp)
+
+        # Segments are stored in the same way as by prepare_inventory_file
+        # and prepare_parse_cache.
+        inventories[str(language_id)] = [
+            normalize('NFD', segment) for segment in segments]
+        new_segments = [segment.replace('(', '').replace(')', '')
+                        for segment in segments]
+        new_segments = [segment for segment in new_segments
+                        if segment not in parses_cache]
+        for segment, result in segment_parser.parse_many(new_segments):
+            if isinstance(result, SegmentParseError):
+                print(f'Failed to parse /{segment}/', file=sys.stderr)
+                continue
+            parses_cache[segment] = result.as_list()
+
+        # The parses go first, so that the inventories
+        # never refer to segments that were not parsed.
+        write_json_atomically(parses_cache, 'parses_cache.json')
+        write_feature_store(parses_cache, 'parses_cache.bin')
+        write_json_atomically(inventories, 'inventories.json')
+        write_inventory_store(inventories, 'inventories.bin')
+        load_language_meta()
+        engines[False] = build_engine(False)
+        if go_pool is not None:
+            go_pool.restart()
 
 
 #
@@ -264,31 +579,82 @@ def print_genus_tree():
 
 
 def parse_query(query_string):
-    "We separate this bit into a separate function to catch Lark exceptions."
-    return query_parser.parse(query_string)
+    """
+    Returns the AST of the query. We separate this bit into a separate
+    function to catch Lark exceptions. ASTs are cached by the raw query
+    string and shared, so callers must not modify them.
+    """
+    query = parsed_query_cache.get(query_string)
+    if query is None:
+        query = query_transformer.transform(
+            query_parser.parse(query_string))
+        parsed_query_cache.put(query_string, query)
+    return query
+
+
+def apply_query_and_filter(query, restrictor_dict={}, query_phoible=False):
+    """
+    Returns a dictionary describing the languages satisfying the query.
+    Results are cached by the canonical form of the query; the cached
+    dictionaries are shared, so callers must not modify them.
+    """
+    # The restrictor bitmap and the query must use the same engine,
+    # and the result is cached under the version of its data.
+    engine = get_engine(query_phoible)
+    cache_key = (
+        get_canonical_form(query),
+        query_phoible,
+        tuple(
+            (k, v if isinstance(v, str) else tuple(sorted(v)))
+            for k, v in sorted(restrictor_dict.items())),
+        engine.version
+    )
+    result = query_result_cache.get(cache_key)
+    if result is None:
+        result = describe_languages(
+            apply_query(
+                optimise_query(query, query_phoible),
+                query_phoible,
+                get_restrictor_bitmap(restrictor_dict, query_phoible, engine),
+                engine),
+            query_phoible)
+        query_result_cache.put(cache_key, result)
+    return result
 
 
-def apply_query_and_filter(query_tree, restrictor_dict={}, query_phoible=False):
-    # Transforming the query after successfully parsing it should be safe.
-    query = query_transformer.transform(query_tree)
-    result = apply_query(query, db_connection, query_phoible)
+def get_restrictor_bitmap(restrictor_dict, query_phoible=False, engine=None):
+    """
+    Returns the bitmap of languages from the phyla or genera in restrictor_dict,
+    which is then used as the set of candidates for the query, or None if
+    there is no restriction.
+    """
     if 'phylum' in restrictor_dict:
-        phyla = restrictor_dict['phylum']
-        result = list(
-            filter(lambda lang_id: meta[lang_id].phylum in phyla, result))
+        field, allowed = 'phylum', restrictor_dict['phylum']
     elif 'genus' in restrictor_dict:
-        genera = restrictor_dict['genus']
-        result = list(
-            filter(lambda lang_id: meta[lang_id].genus in genera, result))
+        field, allowed = 'genus', restrictor_dict['genus']
+    else:
+        return None
+    if engine is None:
+        engine = get_engine(query_phoible)
+    language_ids = engine.language_ids.tolist()
+    if query_phoible:
+        return np.array([getattr(meta_phoible[lang_id], field) in allowed
+                         for lang_id in language_ids], dtype=bool)
+    else:
+        return np.array([lang_id in meta and getattr(meta[lang_id], field) in allowed
+                         for lang_id in language_ids], dtype=bool)
+
+
+def describe_languages(result, query_phoible):
     if query_phoible:
         result = {
             lang_id: {
-                'name': meta_phoible[str(lang_id)]['name'],
-                'glottocode': meta_phoible[str(lang_id)]['glottocode'],
-                'phylum': meta_phoible[str(lang_id)]['phylum'],
-                'genus': meta_phoible[str(lang_id)]['genus'],
-                'latitude': meta_phoible[str(lang_id)]['latitude'],
-                'longitude': meta_phoible[str(lang_id)]['longitude']
+                'name': meta_phoible[lang_id].name,
+                'glottocode': meta_phoible[lang_id].glottocode,
+                'phylum': meta_phoible[lang_id].phylum,
+                'genus': meta_phoible[lang_id].genus,
+                'latitude': meta_phoible[lang_id].latitude,
+                'longitude': meta_phoible[lang_id].longitude
             } for lang_id in result
         }
     else:
@@ -305,64 +671,7 @@ def apply_query_and_filter(query_tree, restrictor_dict={}, query_phoible=False):
     return result
 
 
-#
-# Legacy slow code; can be still useful for testing
-#
-
-# def apply_eq_phoneme(query: EqPhoneme, db_connection: sqlite3.Connection):
-#     result = set()
-#     test_segment = normalize('NFD', query.phoneme)
-#     for language_id in get_all_language_ids(db_connection):
-#         segment_count = 0
-#         for (segment,) in db_connection.execute(
-#             'SELECT ipa FROM segments WHERE `language_id` = ?',
-#             (language_id,)
-#         ):
-#             if segment == test_segment:
-#                 segment_count += 1
-#                 # We expect to see each segment only once
-#                 # in an inventory.
-#                 break
-#         diff = segment_count - query.number
-#         if check_eq(diff, query.op):
-#             result.add(language_id)
-#     return result
-
-
-# def apply_eq_feature(query: EqFeature, db_connection: sqlite3.Connection):
-#     result = set()
-#     # A search optimisation: only check the subset once for each segment.
-#     hit_tmp = {}
-#     for language_id in get_all_language_ids(db_connection):
-#         diff = get_count_for_features(
-#             language_id,
-#             query.features,
-#             db_connection,
-#             hit_tmp) - query.number
-#         if check_eq(diff, query.op):
-#             result.add(language_id)
-#     return result
-
-
-# def apply_eq_features(query: EqFeatures, db_connection: sqlite3.Connection):
-#     result = set()
-#     # Two caches for two sets of features.
-#     hit_tmp1 = {}
-#     hit_tmp2 = {}
-#     for language_id in get_all_language_ids(db_connection):
-#         lhs_count = get_count_for_features(
-#             language_id, query.features_1, db_connection, hit_tmp1)
-#         rhs_count = get_count_for_features(
-#             language_id, query.features_2, db_connection, hit_tmp2)
-#         diff = lhs_count - rhs_count
-#         if check_eq(diff, query.op):
-#             result.add(language_id)
-#     return result
-
-
 if __name__ == "__main__":
-    import sys
-
     if len(sys.argv) < 2 or len(sys.argv) > 3:
         print(USAGE_short)
         sys.exit()
@@ -394,12 +703,13 @@ if __name__ == "__main__":
 
     query_phoible = False
 
-    result = apply_query(query, db_connection, query_phoible)
+    query = optimise_query(query, query_phoible)
+    print('Optimised query:')
+    print(query, '\n')
 
-    # Filter by phylum or genus when applicable
+    # Restrict the search by phylum or genus when applicable
+    restrictor_dict = {}
     if len(sys.argv) > 2:
-        phyla = None
-        genera = None
         restrictor = sys.argv[2]
         if not (
             restrictor.startswith('phylum=')
@@ -408,18 +718,18 @@ if __name__ == "__main__":
             print(USAGE_short)
             sys.exit(1)
         if restrictor.startswith('phylum'):
-            phyla = restrictor.split('=')[1].split(',')
-            result = list(
-                filter(lambda lang_id: meta[lang_id].phylum in phyla, result))
+            restrictor_dict['phylum'] = restrictor.split('=')[1].split(',')
         else:
-            genera = restrictor.split('=')[1].split(',')
-            result = list(
-                filter(lambda lang_id: meta[lang_id].genus in genera, result))
+            restrictor_dict['genus'] = restrictor.split('=')[1].split(',')
+
+    result = apply_query(
+        query, query_phoible,
+        get_restrictor_bitmap(restrictor_dict, query_phoible))
 
     # Format the output
     if query_phoible:
         result = list(
-            map(lambda lang_id: f'{meta_phoible[str(lang_id)]["name"]} ({meta_phoible[str(lang_id)]["glottocode"]})', result))
+            map(lambda lang_id: f'{meta_phoible[lang_id].name} ({meta_phoible[lang_id].glottocode})', result))
     else:
         result = list(
             map(lambda lang_id: f'{meta[lang_id].name} ({meta[lang_id].iso})', result))